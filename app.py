@@ -1,12 +1,25 @@
 import gradio as gr
+import anyio
+import numpy as np
 import pandas as pd
-from keyword_analysis import PromptAnalyzer, analyze_word_differences
-from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pacsv
+from keyword_analysis import PromptAnalyzer, analyze_word_differences, HTML_ESCAPE_TABLE, init_jieba
+from dateutil import tz
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import os
+import csv
+import hashlib
+import string
+import tempfile
 import traceback
 import logging
-import jieba
 import time
+import threading
+import heapq
 
 # 配置日志
 logging.basicConfig(
@@ -19,252 +32,85 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class PromptAnalysisApp:
-    def __init__(self):
-        self.analyzer = PromptAnalyzer()
-        self.df = None
-        self.current_results = {}
-        self.logger = logging.getLogger(__name__)
-        
-        # 添加模型加载状态检查
-        try:
-            self.analyzer.check_models()
-        except Exception as e:
-            self.logger.error(f"模型加载失败: {str(e)}")
-            raise
-        
-    def load_data(self, csv_file):
-        """加载CSV数据"""
-        try:
-            if csv_file is None:
-                return gr.Dropdown(choices=[], value=None, label="请先上传CSV文件")
-            
-            self.df = pd.read_csv(csv_file.name)
-            # 确保用户ID为字符串类型
-            self.df['用户UID'] = self.df['用户UID'].astype(str)
-            unique_users = self.df['用户UID'].unique().tolist()
-            
-            print(f"成功加载CSV文件，共有 {len(unique_users)} 个用户")
-            return gr.Dropdown(
-                choices=unique_users,
-                label=f"选择用户 (共{len(unique_users)}个)",
-                value=unique_users[0] if unique_users else None
-            )
-        except Exception as e:
-            print(f"加载CSV文件时出错: {str(e)}")
-            return gr.Dropdown(choices=[], value=None, label="加载文件失败")
-    
-    def analyze_user(self, user_id):
-        """分析单个用户的Prompts"""
-        try:
-            if self.df is None:
-                return "请先上传CSV文件"
-            if user_id is None:
-                return "请选择用户"
-            
-            print(f"开始分析用户: {user_id}")
-            
-            # 确保用户ID为字符串类型并获取用户数据
-            user_data = self.df[self.df['用户UID'].astype(str) == str(user_id)]
-            
-            if user_data.empty:
-                return f"未找到用户 {user_id} 的数据"
-            
-            # 检查时间字段
-            time_column = None
-            if '生成时间(精确到秒)' in user_data.columns:
-                time_column = '生成时间(精确到秒)'
-            elif 'p_date' in user_data.columns:
-                time_column = 'p_date'
-            else:
-                return "CSV文件缺少时间字段: 需要 'p_date' 或 '生成时间(精确到秒)'"
-            
-            # 检查必要的列是否存在
-            if '生成结果预览图' not in user_data.columns:
-                return "CSV文件缺少必要的列: 生成结果预览图"
-            
-            # 检查数据有效性 - 修改这里，不要过滤掉垫图
-            valid_data = user_data.dropna(subset=['prompt', time_column])
-            if len(valid_data) == 0:
-                return f"用户 {user_id} 没有有效的Prompt数据"
-            
-            print("\n=== 数据验证 ===")
-            print(f"列名: {valid_data.columns.tolist()}")
-            print(f"垫图列存在: {'指令编辑垫图' in valid_data.columns}")
-            if '指令编辑垫图' in valid_data.columns:
-                print(f"有垫图的行数: {valid_data['指令编辑垫图'].notna().sum()}")
-            
-            print(f"找到 {len(valid_data)} 条有效数据")
-            print(f"使用时间字段: {time_column}")
-            
-            # 添加数据量检查
-            print("\n=== 数据统计 ===")
-            print(f"原始数据量: {len(user_data)}")
-            print(f"有效数据量: {len(valid_data)}")
-            
-            # 按时间和prompt分组时记录每张图片的保存状态
-            grouped_data = {}
-            for _, row in valid_data.iterrows():
-                key = (row[time_column], row['prompt'])
-                preview_url = row.get('生成结果预览图')
-                reference_img = row.get('指令编辑垫图') if pd.notna(row.get('指令编辑垫图')) else None
-                enter_from = row.get('生成来源（埋点enter_from）') if pd.notna(row.get('生成来源（埋点enter_from）')) else None
-                
-                print(f"\n处理行: prompt={row['prompt'][:30]}...")
-                print(f"垫图: {reference_img}")
-                
-                if key not in grouped_data:
-                    grouped_data[key] = {
-                        'timestamp': row[time_column],
-                        'prompt': row['prompt'],
-                        'preview_url': [preview_url] if pd.notna(preview_url) else [],
-                        'reference_img': reference_img,
-                        'saved_images': [row['是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)']] if pd.notna(preview_url) else [],
-                        'enter_from': enter_from
-                    }
-                else:
-                    if pd.notna(preview_url):
-                        grouped_data[key]['preview_url'].append(preview_url)
-                        grouped_data[key]['saved_images'].append(row['是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)'])
-            
-            # 打印分组后的数据
-            print("\n=== 分组后的数据 ===")
-            for key, data in grouped_data.items():
-                print(f"\n时间: {data['timestamp']}")
-                print(f"Prompt: {data['prompt']}")
-                print(f"垫图: {data['reference_img']}")
-                print(f"预览图数量: {len(data['preview_url'])}")
-            
-            # 转换为DataFrame
-            temp_df = pd.DataFrame([{
-                'timestamp': v['timestamp'],
-                'prompt': v['prompt'],
-                'preview_url': v['preview_url'],
-                'reference_img': v['reference_img'],
-                'saved_images': v['saved_images'],
-                'enter_from': v['enter_from']  # 确保包含生成来源
-            } for v in grouped_data.values() 
-            if v['preview_url']])  # 只保留有图片的数据
-            
-            if len(temp_df) == 0:
-                return "没有找到有效的图片数据"
-            
-            # 标准化时间格式
-            try:
-                if time_column == '生成时间(精确到秒)':
-                    # 将 Unix timestamp 转换为 datetime
-                    temp_df['timestamp'] = pd.to_datetime(temp_df['timestamp'].astype(int), unit='s')
-                else:
-                    # 处理 p_date 格式
-                    temp_df['timestamp'] = pd.to_datetime(temp_df['timestamp'])
-                
-                # 转换为统一的字符串格式
-                temp_df['timestamp'] = temp_df['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
-                
-            except Exception as e:
-                print(f"时间格式转换出错: {str(e)}")
-                return f"时间格式转换失败: {str(e)}"
-            
-            # 调用聚类分析前打印信息
-            print("\n=== 开始聚类 ===")
-            print(f"待聚类数据量: {len(temp_df)}")
-            
-            # 调用聚类分析
-            results = self.analyzer.analyze_user_prompts(temp_df, str(user_id))
-            
-            # 检查聚类结果
-            if results is None:
-                return "聚类分析返回空结果"
-            
-            if not isinstance(results, dict) or 'clusters' not in results:
-                return "聚类结果格式错误"
-            
-            clusters = results['clusters']
-            print("\n=== 聚类结果统计 ===")
-            print(f"聚类总数: {len(clusters)}")
-            print(f"各聚类大小: {[len(prompts) for prompts in clusters.values()]}")
-            
-            self.current_results = results
-            return results  # 返回原始结果而不是视图
-            
-        except Exception as e:
-            print(f"分析用户时出错: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return f"分析出错: {str(e)}"
-    
-    def generate_analysis_view(self, results):
-        """生成分析视图HTML"""
-        try:
-            if not results.get('clusters'):
-                return "没有找到可分析的数据"
-                
-            # 对聚类按大小排序
-            sorted_clusters = sorted(
-                results['clusters'].items(),
-                key=lambda x: len(x[1]),
-                reverse=True
-            )
-            
-            html = self.get_style_html()
-            
-            # 添加统计信息
-            total_prompts = sum(len(prompts) for _, prompts in sorted_clusters)
-            html += f"""
-            <div class="section-title">
-                分析结果 (共 {total_prompts} 条Prompt，{len(sorted_clusters)} 个聚类)
-            </div>
-            """
-            
-            # 时间轴视图（只显示最新的50条）
-            html += '<div class="section-title">Prompt 时间轴（最新50条）</div>'
-            all_prompts = []
-            for cluster in results['clusters'].values():
-                all_prompts.extend(cluster)
-            
-            # 按时间排序并限制显示数量
-            all_prompts.sort(key=lambda x: x['timestamp'], reverse=True)
-            display_prompts = all_prompts[:50]
-            
-            for i, prompt in enumerate(display_prompts):
-                html += self.generate_prompt_card(
-                    prompt, 
-                    prev_prompt=display_prompts[i-1] if i > 0 else None
-                )
-            
-            # 聚类视图
-            html += f'<div class="section-title">Prompt 聚类分析</div>'
-            for cluster_id, prompts in sorted_clusters:
-                # 对每个聚类的显示也限制数量
-                display_prompts = sorted(prompts, key=lambda x: x['timestamp'], reverse=True)[:50]
-                
-                html += f"""
-                <div class="cluster-section">
-                    <div class="cluster-header">
-                        <span class="cluster-title">聚类 {cluster_id}</span>
-                        <span class="cluster-count">共 {len(prompts)} 条Prompt {f'(显示最新50条)' if len(prompts) > 50 else ''}</span>
-                    </div>
-                """
-                
-                for p in display_prompts:
-                    html += self.generate_prompt_card(p)
-                
-                html += "</div>"
-            
-            return html
-            
-        except Exception as e:
-            print(f"生成分析视图时出错: {str(e)}")
-            return f"生成视图失败: {str(e)}"
-    
-    def get_style_html(self):
-        """返回样式HTML"""
-        # 使用每小时更新一次的版本号,而不是每秒
-        version = int(time.time() / 3600)
-        return f"""
-        <style data-version="{version}">
+# 分析视图每页显示的聚类数
+_CLUSTERS_PER_PAGE = 20
+
+# 同时处理的请求数，模型推理在 CPU 上进行，不宜过多
+_QUEUE_CONCURRENCY = 4
+
+# 上传解析（读 CSV、算 SHA-1）单独限流，不和分析、详情查看抢 worker
+_UPLOAD_CONCURRENCY = 2
+
+# 查看聚类详情只是渲染 HTML，开销小，允许更多并发
+_DETAILS_CONCURRENCY = 16
+
+# 线程池大小，按核数而不是默认的 40 个；编码和聚类在 numpy/torch 中会释放 GIL，取两倍核数
+_MAX_THREADS = 2 * (os.cpu_count() or 4)
+
+# 公网分享隧道默认关闭，需要时设置 GRADIO_SHARE=1
+_SHARE = os.environ.get("GRADIO_SHARE", "0") == "1"
+
+# 聚类详情最多显示的卡片数，只显示最新的这些，控制单个视图的大小
+_CLUSTER_CARDS_LIMIT = 50
+
+# 分析完成后预先渲染详情的聚类数，只渲染最大的这些，其余在点击时再渲染
+_PRERENDER_CLUSTERS = _CLUSTERS_PER_PAGE
+
+# 超过此大小的聚类详情写成静态文件，用 iframe 引用，不再整段经 websocket 推送
+_INLINE_HTML_LIMIT = 100 << 10
+
+# 聚类详情静态文件目录，启动时加入 allowed_paths
+_CLUSTER_HTML_DIR = os.path.join(tempfile.gettempdir(), 'prompt_analyser_clusters')
+
+# 静态文件的保留时间与结果缓存一致，文件数超过上限时删除最久未用的
+_CLUSTER_HTML_TTL = 3600
+_CLUSTER_HTML_MAX_FILES = 256
+
+# 应用实际用到的列，其余列在解析阶段直接跳过
+_CSV_COLUMNS = [
+    '用户UID',
+    'prompt',
+    '生成时间(精确到秒)',
+    'p_date',
+    '生成结果预览图',
+    '指令编辑垫图',
+    '生成来源（埋点enter_from）',
+    '是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)',
+    '聚类ID',
+]
+
+# PyArrow 每个解析线程处理的块大小
+_CSV_BLOCK_SIZE = 8 << 20
+
+
+def read_prompt_csv(path):
+    """使用 PyArrow 多线程解析CSV，只保留需要的列，返回 Arrow Table"""
+    # 先读取表头，include_columns 遇到不存在的列会报错
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        header = next(csv.reader(f), [])
+    return pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=_CSV_BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=[col for col in _CSV_COLUMNS if col in header],
+            # 用户ID和来源都是重复很多的短字符串，按字典编码读取，转换后直接是 category
+            column_types={
+                '用户UID': pa.dictionary(pa.int32(), pa.string()),
+                '生成来源（埋点enter_from）': pa.dictionary(pa.int32(), pa.string()),
+            }
+        )
+    )
+
+# 样式版本号在导入时计算一次, 样式HTML只构建一次
+_STYLE_VERSION = int(time.time() / 3600)
+
+# 界面根节点的类名和 Blocks 的 css 同样只在导入时生成
+_ROOT_OPEN_HTML = f'<div class="gradio-app-{_STYLE_VERSION}">'
+_BLOCKS_CSS = f".gradio-app {{ --app-version: {_STYLE_VERSION}; }}"
+_STYLE_HTML = f"""
+        <style data-version="{_STYLE_VERSION}">
         /* 确保样式作用域限定在gradio应用内 */
-        .gradio-app-{version} {{
+        .gradio-app-{_STYLE_VERSION} {{
             /* 深色模式基础变量 */
             --background-base: #000000;          /* 最深的背景色（整体背景） */
             --background-primary: #1a1a1a;       /* 主要背景色（卡片背景） */
@@ -281,208 +127,59 @@ class PromptAnalysisApp:
             --success-color: #52c41a;           /* 成功状态颜色 */
         }}
 
-        /* 所有样式规则需要添加.gradio-app-{version}作为父选择器 */
-        .gradio-app-{version} .gradio-container,
-        .gradio-app-{version} .gradio-box,
-        .gradio-app-{version} .contain {{
+        /* 所有样式规则需要添加.gradio-app-{_STYLE_VERSION}作为父选择器 */
+        .gradio-app-{_STYLE_VERSION} .gradio-container,
+        .gradio-app-{_STYLE_VERSION} .gradio-box,
+        .gradio-app-{_STYLE_VERSION} .contain {{
             background-color: var(--background-base) !important;
             color: var(--text-primary) !important;
         }}
 
         /* 其他样式规则同样添加作用域... */
-        .gradio-app-{version} .gr-box,
-        .gradio-app-{version} .gr-panel,
-        .gradio-app-{version} .gr-block,
-        .gradio-app-{version} .gr-form,
-        .gradio-app-{version} .input-box,
-        .gradio-app-{version} .output-box {{
+        .gradio-app-{_STYLE_VERSION} .gr-box,
+        .gradio-app-{_STYLE_VERSION} .gr-panel,
+        .gradio-app-{_STYLE_VERSION} .gr-block,
+        .gradio-app-{_STYLE_VERSION} .gr-form,
+        .gradio-app-{_STYLE_VERSION} .input-box,
+        .gradio-app-{_STYLE_VERSION} .output-box {{
             background-color: var(--background-primary) !important;
             border-color: var(--border-color) !important;
             color: var(--text-primary) !important;
         }}
 
         /* 修复滚动条样式 */
-        .gradio-app-{version} ::-webkit-scrollbar {{
+        .gradio-app-{_STYLE_VERSION} ::-webkit-scrollbar {{
             width: 8px;
             height: 8px;
         }}
 
-        .gradio-app-{version} ::-webkit-scrollbar-track {{
+        .gradio-app-{_STYLE_VERSION} ::-webkit-scrollbar-track {{
             background: var(--background-secondary);
         }}
 
-        .gradio-app-{version} ::-webkit-scrollbar-thumb {{
+        .gradio-app-{_STYLE_VERSION} ::-webkit-scrollbar-thumb {{
             background: var(--border-color);
             border-radius: 4px;
         }}
 
-        .gradio-app-{version} ::-webkit-scrollbar-thumb:hover {{
+        .gradio-app-{_STYLE_VERSION} ::-webkit-scrollbar-thumb:hover {{
             background: var(--background-hover-light);  /* 使用新的hover变量 */
         }}
 
-        /* 其他样式保持不变,但都需要添加.gradio-app-{version}作用域... */
+        /* 其他样式保持不变,但都需要添加.gradio-app-{_STYLE_VERSION}作用域... */
         </style>
         """
-    
-    def generate_prompt_card(self, prompt, prev_prompt=None):
-        try:
-            # 添加调试日志
-            print("\n=== 生成Prompt卡片 ===")
-            print(f"时间戳: {prompt.get('timestamp')}")
-            print(f"生成来源: {prompt.get('enter_from')}")
-            
-            # 获取生成来源信息
-            enter_from = f'<span class="enter-from" style="color: var(--text-primary);">{prompt.get("enter_from", "")}</span>' if prompt.get("enter_from") else ''
-            
-            html = f"""
-            <div class="prompt-card" style="background-color: var(--background-primary); color: var(--text-primary);">
-                <div class="prompt-content">
-                    <div class="header-row">
-                        <div class="timestamp" style="color: var(--text-secondary);">{prompt['timestamp']}</div>
-                        {enter_from}
-                    </div>
-                    
-                    <div class="prompt-row">
-                        <!-- 左侧 Prompt 部分 -->
-                        <div class="prompt-col">
-                            {self.generate_diff_section(prev_prompt, prompt) if prev_prompt else ''}
-                            <div class="prompt-text" style="color: var(--text-primary);">{prompt["prompt"]}</div>
-                        </div>
-                        
-                        <!-- 右侧垫图部分 -->
-                        {self.generate_reference_section(prompt) if prompt.get('reference_img') and prompt['reference_img'].strip() else ''}
-                    </div>
-                    
-                    <!-- 生成结果展示 -->
-                    <div class="section-label" style="color: var(--text-primary);">生成结果：</div>
-                    {self.generate_image_grid(prompt)}
-                </div>
-            </div>
-            """
-            return html
-        except Exception as e:
-            print(f"生成Prompt卡片时出错: {str(e)}")
-            return ""
-
-    def generate_diff_section(self, prev_prompt, curr_prompt):
-        """生成差异分析部分的HTML"""
-        diff = analyze_word_differences(prev_prompt['prompt'], curr_prompt['prompt'])
-        if not (diff['prev_unique'] or diff['curr_unique']):
-            return ''
-        
-        return f"""
-        <div class="diff-section" style="background-color: var(--background-secondary); color: var(--text-primary);">
-            <div class="version-text">原始版本: {diff["prev_html"]}</div>
-            <div class="version-text current">当前版本: {diff["curr_html"]}</div>
-            <div class="change-summary">
-                {f'<span class="word-removed">删除: {", ".join(diff["prev_unique"])}</span>' if diff['prev_unique'] else ''}
-                {' | ' if diff['prev_unique'] and diff['curr_unique'] else ''}
-                {f'<span class="word-added">新增: {", ".join(diff["curr_unique"])}</span>' if diff['curr_unique'] else ''}
-            </div>
-        </div>
-        """
-
-    def generate_reference_section(self, prompt):
-        """生成垫图部分的HTML"""
-        if not (prompt.get('reference_img') and prompt['reference_img'].strip()):
-            return ''
-        
-        return f"""
-        <div class="reference-section" style="background-color: var(--background-secondary); color: var(--text-primary);">
-            <div class="section-label">
-                <span class="label-icon">📎</span> 参考图
-            </div>
-            <div class="reference-image">
-                <img src="{prompt['reference_img']}" alt="参考图" 
-                     onerror="this.parentElement.parentElement.style.display='none';">
-            </div>
-        </div>
-        """
-
-    def generate_image_grid(self, prompt):
-        """生成图片网格的HTML，确保1*4排列"""
-        # 处理预览图URL
-        preview_urls = prompt['preview_url']
-        if isinstance(preview_urls, str):
-            # 如果是单个URL，尝试解析是否包含多个URL
-            if ',' in preview_urls:
-                preview_urls = [url.strip() for url in preview_urls.split(',')]
-            else:
-                preview_urls = [preview_urls]
-        
-        # 处理保存状态
-        saved_images = prompt.get('saved_images', [False] * len(preview_urls))
-        if not isinstance(saved_images, list):
-            if ',' in str(saved_images):
-                saved_images = [s.strip().lower() == 'true' for s in str(saved_images).split(',')]
-            else:
-                saved_images = [saved_images] * len(preview_urls)
-        
-        # 确保只处理4张图片
-        preview_urls = preview_urls[:4]
-        saved_images = saved_images[:4]
-        
-        grid_html = '<div class="image-grid">'
-        
-        # 生成图片容器
-        for url, is_saved in zip(preview_urls, saved_images):
-            if pd.notna(url) and url.strip():
-                grid_html += f"""
-                <div class="image-container">
-                    <img src="{url.strip()}" alt="预览图" 
-                         onerror="this.parentElement.innerHTML='<div class=\'image-error\'>图片加载失败</div>';">
-                    {f'<div class="saved-badge">已保存</div>' if is_saved else ''}
-                </div>
-                """
-        
-        # 如果图片不足4张，添加空白占位
-        for _ in range(4 - len(preview_urls)):
-            grid_html += """
-            <div class="image-container">
-                <div class="image-error">暂无图片</div>
-            </div>
-            """
-        
-        grid_html += '</div>'
-        return grid_html
-
-    def generate_cluster_section(self, cluster_id, prompts):
-        """生成聚类部分的HTML"""
-        try:
-            html = f"""
-            <div class="cluster-section">
-                <h4>聚类 {cluster_id} ({len(prompts)} 条Prompt)</h4>
-            """
-            
-            for p in prompts:
-                html += self.generate_prompt_card(p)
-            
-            html += "</div>"
-            return html
-        except Exception as e:
-            print(f"生成聚类部分时出错: {str(e)}")
-            return ""
 
-    def get_enter_from_text(self, enter_from):
-        """转换来源代码为可读文本"""
-        if not enter_from:  # 如果字段为空或不存在，显示 "-"
-            return "-"
-        
-        source_map = {
-            'default': '直接输入',
-            'new_user_instruction': '新手引导',
-            'modal_click': '模态切换',
-            'remix': '做同款',
-            'assets': '资产页',
-            'generate_result': '重新编辑'
-        }
-        return source_map.get(enter_from, enter_from)
+# 静态聚类详情文件的首尾：iframe 中的文档不继承页面样式，单独带上样式变量和深色背景
+_CLUSTER_DOC_HEAD = (
+    f'<!DOCTYPE html><html><head><meta charset="utf-8">{_STYLE_HTML}</head>'
+    f'<body style="margin:0;background-color:#000000;color:#ffffff">'
+    f'<div class="gradio-app-{_STYLE_VERSION}">'
+).encode('utf-8')
+_CLUSTER_DOC_TAIL = b'</div></body></html>'
 
-    def generate_cluster_view(self, prompts):
-        """生成聚类详情视图"""
-        try:
-            html = self.get_style_html()
-            html += """
+# 聚类详情视图自带的样式，作为模块常量共享
+_CLUSTER_STYLE_HTML = """
             <style>
             .cluster-container {
                 background: #1a1b1e;
@@ -650,122 +347,918 @@ class PromptAnalysisApp:
             }
             </style>
             """
-            
-            # 按时间和Prompt分组
-            groups = {}
-            for prompt in prompts:
-                key = (prompt['timestamp'], prompt['prompt'])
-                if key not in groups:
-                    groups[key] = {
-                        'timestamp': prompt['timestamp'],
-                        'prompt': prompt['prompt'],
-                        'images': [],
-                        'reference_img': prompt.get('reference_img', ''),
-                        'enter_from': prompt.get('enter_from', None)  # 使用 get 方法，设置默认值为 None
-                    }
-                
-                # 添加图片和保存状态
-                url = prompt['preview_url']
-                saved = prompt.get('saved_images', False)
-                if url and pd.notna(url):
-                    groups[key]['images'].append({
-                        'url': url.strip(),
-                        'saved': saved
-                    })
-            
-            # 转换为列表并排序
-            sorted_groups = sorted(groups.values(), key=lambda x: int(x['timestamp']))
-            
-            html += '<div class="cluster-details">'
-            
-            for i, group in enumerate(sorted_groups):
-                timestamp = datetime.fromtimestamp(int(group['timestamp'])).strftime('%Y-%m-%d %H:%M:%S')
-                source_text = self.get_enter_from_text(group.get('enter_from'))  # 使用 get 方法获取来源
-                
-                # 生成差异分析
-                diff_html = ''
-                if i > 0:
-                    prev_group = sorted_groups[i-1]
-                    diff = analyze_word_differences(prev_group['prompt'], group['prompt'])
-                    if diff['prev_unique'] or diff['curr_unique']:
-                        removed_words = diff['prev_unique']
-                        added_words = diff['curr_unique']
-                        
-                        if removed_words or added_words:
-                            diff_html = f"""
-                            <div class="diff-section">
-                                <div class="diff-header">与上一条Prompt的差异：</div>
-                                <div class="diff-content">
-                                    <div class="diff-text">{diff['curr_html']}</div>
-                                    <div class="diff-summary">
-                                        {f'<div class="word-removed">删除: {", ".join(removed_words)}</div>' if removed_words else ''}
-                                        {f'<div class="word-added">新增: {", ".join(added_words)}</div>' if added_words else ''}
-                                    </div>
-                                </div>
-                            </div>
-                            """
-                
-                # 生成图片网格
-                grid_html = '<div class="image-grid">'
-                for img in group['images'][:4]:  # 限制最多4张图
-                    grid_html += f"""
-                    <div class="image-container">
-                        <img src="{img['url']}" alt="预览图" 
-                             onerror="this.parentElement.innerHTML='<div class=\'image-error\'>加载失败</div>';">
-                        {f'<div class="saved-badge">已保存</div>' if img['saved'] else ''}
+
+# Prompt卡片模板，导入时编译一次
+_CARD_TMPL = string.Template("""
+            <div class="prompt-card" style="background-color: var(--background-primary); color: var(--text-primary);">
+                <div class="prompt-content">
+                    <div class="header-row">
+                        <div class="timestamp" style="color: var(--text-secondary);">$timestamp</div>
+                        $enter_from
                     </div>
-                    """
-                grid_html += '</div>'
-                
-                html += f"""
-                <div class="cluster-container">
-                    <div class="prompt-header">
-                        <div class="timestamp-group">
-                            <div class="timestamp">{timestamp}</div>
-                            <div class="source-tag">来源：{source_text}</div>
+                    
+                    <div class="prompt-row">
+                        <!-- 左侧 Prompt 部分 -->
+                        <div class="prompt-col">
+                            $diff_section
+                            <div class="prompt-text" style="color: var(--text-primary);">$prompt_text</div>
                         </div>
-                        <div class="image-count">生成数量：{len(group['images'])}</div>
+                        
+                        <!-- 右侧垫图部分 -->
+                        $reference_section
                     </div>
-                    <div class="prompt-card">
-                        <div class="prompt-main">
-                            {diff_html}
-                            <div class="prompt-text">{group['prompt']}</div>
-                            <div class="preview-section">
-                                {grid_html}
-                            </div>
-                        </div>
-                        <div class="prompt-side">
-                            {f'''
-                            <div class="reference-image">
-                                <div class="image-label">垫图</div>
-                                <img src="{group['reference_img']}" alt="垫图"
-                                     onerror="this.parentElement.style.display='none';">
+                    
+                    <!-- 生成结果展示 -->
+                    <div class="section-label" style="color: var(--text-primary);">生成结果：</div>
+                    $image_grid
+                </div>
+            </div>
+            """)
+
+# 图片容器模板，按 (未保存, 已保存) 两种情况分别编译，避免每张图再做分支判断
+_IMAGE_TMPLS = tuple(
+    string.Template("""
+                <div class="image-container">
+                    <img src="$url" alt="预览图" 
+                         onerror="this.parentElement.innerHTML='<div class=\\'image-error\\'>图片加载失败</div>';">
+                    """ + badge + """
+                </div>
+                """)
+    for badge in ('', '<div class="saved-badge">已保存</div>')
+)
+
+# 图片不足4张时的空位
+_EMPTY_SLOT_HTML = """
+            <div class="image-container">
+                <div class="image-error">暂无图片</div>
+            </div>
+            """
+
+@lru_cache(maxsize=32)
+def grid_template(saved_flags):
+    """按每格的保存状态拼好整张图片网格的模板，空位用占位补齐，同一形状只拼一次"""
+    slots = [_IMAGE_TMPLS[saved].template.replace('$url', f'$u{i}') for i, saved in enumerate(saved_flags)]
+    slots.extend([_EMPTY_SLOT_HTML] * (4 - len(saved_flags)))
+    return string.Template('<div class="image-grid">' + ''.join(slots) + '</div>')
+
+# 本地时区，与 datetime.fromtimestamp 的显示保持一致
+_LOCAL_TZ = tz.tzlocal()
+
+# 垫图部分模板
+_REFERENCE_TMPL = string.Template("""
+        <div class="reference-section" style="background-color: var(--background-secondary); color: var(--text-primary);">
+            <div class="section-label">
+                <span class="label-icon">📎</span> 参考图
+            </div>
+            <div class="reference-image">
+                <img src="$url" alt="参考图" 
+                     onerror="this.parentElement.parentElement.style.display='none';">
+            </div>
+        </div>
+        """)
+
+# 聚类详情视图的卡片、图片和垫图模板
+_CLUSTER_CARD_TMPL = string.Template("""
+                <div class="cluster-container">
+                    <div class="prompt-header">
+                        <div class="timestamp-group">
+                            <div class="timestamp">$timestamp</div>
+                            <div class="source-tag">来源：$source_text</div>
+                        </div>
+                        <div class="image-count">生成数量：$image_count</div>
+                    </div>
+                    <div class="prompt-card">
+                        <div class="prompt-main">
+                            $diff_html
+                            <div class="prompt-text">$prompt_text</div>
+                            <div class="preview-section">
+                                $grid_html
                             </div>
-                            ''' if group.get('reference_img') else ''}
+                        </div>
+                        <div class="prompt-side">
+                            $reference_section
                         </div>
                     </div>
                 </div>
-                """
+                """)
+
+_CLUSTER_IMAGE_TMPLS = tuple(
+    string.Template("""
+                    <div class="image-container">
+                        <img src="$url" alt="预览图" 
+                             onerror="this.parentElement.innerHTML='<div class=\\'image-error\\'>加载失败</div>';">
+                        """ + badge + """
+                    </div>
+                    """)
+    for badge in ('', '<div class="saved-badge">已保存</div>')
+)
+
+_CLUSTER_REFERENCE_TMPL = string.Template("""
+                            <div class="reference-image">
+                                <div class="image-label">垫图</div>
+                                <img src="$url" alt="垫图"
+                                     onerror="this.parentElement.style.display='none';">
+                            </div>
+                            """)
+
+# 差异部分模板，删除/新增两段按有无单独拼接
+_DIFF_TMPL = string.Template("""
+    <div class="diff-section" style="background-color: var(--background-secondary); color: var(--text-primary);">
+        <div class="version-text">原始版本: $prev_html</div>
+        <div class="version-text current">当前版本: $curr_html</div>
+        <div class="change-summary">
+            $summary
+        </div>
+    </div>
+    """)
+
+_CLUSTER_DIFF_TMPL = string.Template("""
+                        <div class="diff-section">
+                            <div class="diff-header">与上一条Prompt的差异：</div>
+                            <div class="diff-content">
+                                <div class="diff-text">$curr_html</div>
+                                <div class="diff-summary">
+                                    $summary
+                                </div>
+                            </div>
+                        </div>
+                        """)
+
+# 生成来源代码到展示文本的映射
+_SOURCE_MAP = {
+    'default': '直接输入',
+    'new_user_instruction': '新手引导',
+    'modal_click': '模态切换',
+    'remix': '做同款',
+    'assets': '资产页',
+    'generate_result': '重新编辑'
+}
+
+def format_timestamp(ts):
+    """把时间格式化为展示用的字符串，只在渲染卡片时调用"""
+    if hasattr(ts, 'strftime'):
+        return ts.strftime('%Y-%m-%d %H:%M:%S')
+    return str(ts)
+
+def parse_p_date(p_date):
+    """把 p_date 列解析为时间：先整列按 20240101 格式解析，其余的行再交给默认解析器"""
+    p_date = p_date.astype('string')
+    parsed = pd.to_datetime(p_date, format='%Y%m%d', errors='coerce')
+    # 其他写法（如 2024-01-01）只在剩下的行上解析，无法解析的为 NaT
+    remaining = parsed.isna() & p_date.notna()
+    if remaining.any():
+        parsed[remaining] = pd.to_datetime(p_date[remaining], errors='coerce')
+    return parsed
+
+@lru_cache(maxsize=4096)
+def render_diff_section(prev_text, curr_text):
+    """生成差异分析部分的HTML，按两条prompt文本缓存"""
+    diff = analyze_word_differences(prev_text, curr_text)
+    if not (diff['prev_unique'] or diff['curr_unique']):
+        return ''
+    
+    summary = []
+    if diff['prev_unique']:
+        summary.append(f'<span class="word-removed">删除: {", ".join(diff["prev_unique"]).translate(HTML_ESCAPE_TABLE)}</span>')
+    if diff['curr_unique']:
+        summary.append(f'<span class="word-added">新增: {", ".join(diff["curr_unique"]).translate(HTML_ESCAPE_TABLE)}</span>')
+    return _DIFF_TMPL.substitute(
+        prev_html=diff['prev_html'],
+        curr_html=diff['curr_html'],
+        summary=' | '.join(summary)
+    )
+
+@lru_cache(maxsize=4096)
+def render_cluster_diff_section(prev_text, curr_text):
+    """生成聚类详情中的差异部分，按两条prompt文本缓存"""
+    diff = analyze_word_differences(prev_text, curr_text)
+    summary = []
+    if diff['prev_unique']:
+        summary.append(f'<div class="word-removed">删除: {", ".join(diff["prev_unique"]).translate(HTML_ESCAPE_TABLE)}</div>')
+    if diff['curr_unique']:
+        summary.append(f'<div class="word-added">新增: {", ".join(diff["curr_unique"]).translate(HTML_ESCAPE_TABLE)}</div>')
+    if not summary:
+        return ''
+    return _CLUSTER_DIFF_TMPL.substitute(curr_html=diff['curr_html'], summary=''.join(summary))
+
+def file_sha1(path):
+    """分块计算文件的 sha1，用作数据缓存的键"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def publish_cluster_html(html):
+    """把聚类详情写成按内容命名的静态文件，返回引用它的 iframe"""
+    body = html.encode('utf-8')
+    digest = hashlib.sha1(_CLUSTER_DOC_HEAD)
+    digest.update(body)
+    path = os.path.join(_CLUSTER_HTML_DIR, digest.hexdigest() + '.html')
+    # 同样的内容只写一次，浏览器再次打开时直接命中 HTTP 缓存
+    try:
+        # 复用时刷新修改时间，清理按最近使用排序
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(_CLUSTER_HTML_DIR, exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_CLUSTER_DOC_HEAD)
+            f.write(body)
+            f.write(_CLUSTER_DOC_TAIL)
+        os.replace(tmp_path, path)
+        prune_cluster_html()
+    return f'<iframe src="/file={path}" style="width:100%;height:600px;border:0"></iframe>'
+
+def prune_cluster_html(ttl=_CLUSTER_HTML_TTL, max_files=_CLUSTER_HTML_MAX_FILES):
+    """删除过期的聚类详情文件，文件数超过上限时再删除最久未用的"""
+    try:
+        entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(_CLUSTER_HTML_DIR)]
+    except FileNotFoundError:
+        return
+    expired_before = time.time() - ttl
+    entries.sort(reverse=True)
+    for index, (mtime, path) in enumerate(entries):
+        if index >= max_files or mtime < expired_before:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # 其他线程已经删除
+                pass
+
+class ResultCache:
+    """带过期时间的 LRU 缓存"""
+    def __init__(self, maxsize=64, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        # 队列开启后多个请求会在不同线程中同时读写缓存
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.monotonic() - created > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+@lru_cache(maxsize=1)
+def get_prompt_analyzer():
+    """加载模型开销大，整个进程共用一个 PromptAnalyzer"""
+    return PromptAnalyzer()
+
+# 模型在后台单线程加载，同一进程内的多次提交会按顺序复用缓存的实例
+_model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-loader')
+
+def _load_prompt_analyzer():
+    """加载模型并检查状态"""
+    analyzer = get_prompt_analyzer()
+    if not analyzer.check_models():
+        raise RuntimeError("模型未正确加载")
+    return analyzer
+
+class PromptAnalysisApp:
+    def __init__(self):
+        # 模型加载放到后台，界面可以先启动，首次分析时再等待加载完成
+        self._analyzer_future = _model_loader.submit(_load_prompt_analyzer)
+        # jieba 词典默认在第一次分词时才加载，这里用单独的后台线程与模型加载同时进行
+        threading.Thread(target=init_jieba, daemon=True).start()
+        # 分析结果按 (数据指纹, 用户ID) 缓存，视图按结果对象缓存
+        self._result_cache = ResultCache(maxsize=64)
+        self._view_cache = ResultCache(maxsize=64)
+        # 解析后的数据按文件指纹缓存，数据表较大，只保留最近两份
+        self._data_cache = ResultCache(maxsize=2)
+        self.df = None
+        self.current_results = {}
+    
+    @property
+    def analyzer(self):
+        """首次使用时等待后台模型加载完成"""
+        try:
+            return self._analyzer_future.result()
+        except Exception as e:
+            logger.error(f"模型加载失败: {str(e)}")
+            raise
+    
+    @property
+    def df(self):
+        return self._snapshot[0]
+    
+    @df.setter
+    def df(self, df):
+        """设置数据；直接赋值的数据没有文件指纹，用唯一对象作为缓存键"""
+        self._set_df(df, object())
+    
+    @property
+    def _data_key(self):
+        return self._snapshot[2]
+    
+    def _set_df(self, df, data_key):
+        """建立 用户UID -> 行位置 的索引并预先计算整表的派生列，返回加好派生列的数据"""
+        user_groups = {}
+        if df is not None:
+            # 派生列加在浅拷贝上，不修改调用方传入的 DataFrame，也不复制数据本身
+            df = df.copy(deep=False)
+            if '用户UID' in df.columns:
+                # 统一成字符串类别，掩码比较按整数编码进行
+                if not isinstance(df['用户UID'].dtype, pd.CategoricalDtype):
+                    df['用户UID'] = df['用户UID'].astype('string').astype('category')
+                user_groups = df.groupby('用户UID', sort=False, observed=True).indices
+            
+            # 时间和保存状态在整表上一次性转换，分析单个用户时直接使用
+            if '生成时间(精确到秒)' in df.columns:
+                seconds = df['生成时间(精确到秒)']
+                if isinstance(seconds.dtype, np.dtype) and seconds.dtype.kind == 'i':
+                    # 整数秒没有缺失值，直接按 datetime64[s] 解释同一块内存
+                    df['_ts'] = seconds.to_numpy(dtype=np.int64).view('datetime64[s]')
+                else:
+                    seconds = pd.to_numeric(seconds, errors='coerce')
+                    df['_ts'] = pd.to_datetime(seconds, unit='s', errors='coerce')
+            elif 'p_date' in df.columns:
+                p_date = df['p_date']
+                if pd.api.types.is_datetime64_any_dtype(p_date):
+                    df['_ts'] = p_date
+                else:
+                    # 兼容 20240101 和 2024-01-01 两种写法
+                    df['_ts'] = parse_p_date(p_date)
+            if '是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)' in df.columns:
+                saved = df['是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)']
+                if isinstance(saved.dtype, np.dtype) and saved.dtype.kind in 'biuf':
+                    # 数值列直接整列比较，得到 bool 列
+                    df['_saved'] = np.equal(saved.to_numpy(), 1)
+                else:
+                    # 其他类型（字符串、可空整数等）先转成数值，无法解析的值按未采纳处理
+                    df['_saved'] = pd.to_numeric(saved, errors='coerce').eq(1).to_numpy(dtype=bool, na_value=False)
+        
+        # 全部建好后，数据、索引和缓存键作为一个元组整体替换；
+        # 上传可以和分析同时进行，读取方总是拿到同一份完整的快照
+        self._snapshot = (df, user_groups, data_key)
+        return df
+    
+    def get_user_data(self, user_id):
+        """通过预建索引获取单个用户的数据，避免每次全列扫描"""
+        return self.get_user_data_with_key(user_id)[1]
+    
+    def get_user_data_with_key(self, user_id):
+        """返回 (数据指纹, 用户数据)，两者取自同一份快照，可以一起作为结果缓存的键"""
+        df, user_groups, data_key = self._snapshot
+        row_positions = user_groups.get(str(user_id))
+        if row_positions is None:
+            return data_key, df.iloc[0:0]
+        return data_key, df.iloc[row_positions]
+        
+    def load_csv(self, path):
+        """解析CSV并设为当前数据，返回用户列表；所有上传入口共用，同一文件只解析一次"""
+        # 按文件内容指纹缓存解析结果，重复上传同一文件时不再解析
+        data_key = file_sha1(path)
+        cached = self._data_cache.get(data_key)
+        if cached is not None:
+            df, unique_users = cached
+            if data_key != self._data_key:
+                self._set_df(df, data_key)
+        else:
+            table = read_prompt_csv(path)
+            # 直接在 Arrow 列上去重，不必先构造整列 Python 字符串
+            unique_users = pc.unique(table['用户UID']).drop_null().to_pylist()
+            # 逐列转换并释放 Arrow 缓冲区，峰值内存不再是两份完整数据
+            df = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+            # 缓存已加好派生列的数据，重复上传时不必重新解析
+            df = self._set_df(df, data_key)
+            self._data_cache.put(data_key, (df, unique_users))
+        return unique_users
+    
+    def load_data(self, csv_file):
+        """加载CSV数据"""
+        try:
+            if csv_file is None:
+                return gr.update(choices=[], value=None, label="请先上传CSV文件")
+            
+            unique_users = self.load_csv(csv_file.name)
+            
+            logger.info("成功加载CSV文件，共有 %d 个用户", len(unique_users))
+            # 只回传选项和标签，前端在原下拉框上打补丁，不重新挂载组件
+            return gr.update(
+                choices=unique_users,
+                label=f"选择用户 (共{len(unique_users)}个)",
+                value=unique_users[0] if unique_users else None
+            )
+        except Exception as e:
+            logger.error(f"加载CSV文件时出错: {str(e)}")
+            return gr.update(choices=[], value=None, label="加载文件失败")
+    
+    def analyze_user(self, user_id):
+        """分析单个用户的Prompts"""
+        try:
+            if self.df is None:
+                return "请先上传CSV文件"
+            if user_id is None:
+                return "请选择用户"
+            
+            logger.info("开始分析用户: %s", user_id)
+            
+            data_key, user_data = self.get_user_data_with_key(user_id)
+            
+            if user_data.empty:
+                return f"未找到用户 {user_id} 的数据"
+            
+            results = self.analyze_rows(user_data, user_id, cache_key=(data_key, str(user_id)))
+            if isinstance(results, str):
+                return results
+            
+            self.current_results = results
+            return results  # 返回原始结果而不是视图
+            
+        except Exception as e:
+            logger.exception(f"分析用户时出错: {str(e)}")
+            return f"分析出错: {str(e)}"
+    
+    def cached_result(self, cache_key, compute):
+        """按 cache_key 取分析结果，未命中时调用 compute 计算；只缓存成功的结果"""
+        results = self._result_cache.get(cache_key)
+        if results is None:
+            results = compute()
+            if isinstance(results, dict) and 'clusters' in results:
+                self._result_cache.put(cache_key, results)
+        return results
+    
+    def analyze_rows(self, user_data, user_id, cache_key=None):
+        """对给定的数据行做聚类分析，返回结果或错误信息；给出 cache_key 时读写结果缓存，不修改 current_results"""
+        if cache_key is not None:
+            return self.cached_result(cache_key, lambda: self.analyze_rows(user_data, user_id))
+        try:
+            # 检查时间字段
+            time_column = None
+            if '生成时间(精确到秒)' in user_data.columns:
+                time_column = '生成时间(精确到秒)'
+            elif 'p_date' in user_data.columns:
+                time_column = 'p_date'
+            else:
+                return "CSV文件缺少时间字段: 需要 'p_date' 或 '生成时间(精确到秒)'"
+            
+            # 检查必要的列是否存在
+            if '生成结果预览图' not in user_data.columns:
+                return "CSV文件缺少必要的列: 生成结果预览图"
+            
+            # 检查数据有效性 - 修改这里，不要过滤掉垫图
+            # 无法解析的时间在加载时已转换为 NaT，这里一并过滤
+            valid_data = user_data.dropna(subset=['prompt', '_ts'])
+            if len(valid_data) == 0:
+                return f"用户 {user_id} 没有有效的Prompt数据"
+            
+            # 调试信息只在 DEBUG 级别时才构造
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("列名: %s", valid_data.columns.tolist())
+                if '指令编辑垫图' in valid_data.columns:
+                    logger.debug("有垫图的行数: %d", valid_data['指令编辑垫图'].notna().sum())
+                logger.debug("使用时间字段: %s", time_column)
+                logger.debug("原始数据量: %d, 有效数据量: %d", len(user_data), len(valid_data))
+            
+            temp_df = self.group_prompt_rows(valid_data)
+            
+            if len(temp_df) == 0:
+                return "没有找到有效的图片数据"
+            
+            logger.debug("待聚类数据量: %d", len(temp_df))
             
-            html += "</div>"
+            # 调用聚类分析
+            results = self.analyzer.analyze_user_prompts(temp_df, str(user_id))
+            
+            # 检查聚类结果
+            if results is None:
+                return "聚类分析返回空结果"
+            
+            if not isinstance(results, dict) or 'clusters' not in results:
+                return "聚类结果格式错误"
+            
+            clusters = results['clusters']
+            logger.info("用户 %s 聚类完成，共 %d 个聚类", user_id, len(clusters))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("各聚类大小: %s", [len(prompts) for prompts in clusters.values()])
+            
+            # 聚类完成后一次性算好时间轴的相邻差异，渲染时直接取用
+            results['timeline'] = self.build_timeline(results)
+            # 聚类按大小的顺序也只排一次，翻页时直接切片
+            results['cluster_order'] = self.order_clusters(clusters)
+            results['total_prompts'] = sum(len(prompts) for prompts in clusters.values())
+            return results
+            
+        except Exception as e:
+            logger.exception(f"分析用户时出错: {str(e)}")
+            return f"分析出错: {str(e)}"
+    
+    def group_prompt_rows(self, valid_data):
+        """按 (时间, prompt) 分组汇总图片和保存状态，只保留有图片的分组"""
+        # 分组编号按首次出现的顺序分配
+        codes = valid_data.groupby(['_ts', 'prompt'], sort=False).ngroup().to_numpy()
+        first_pos = np.unique(codes, return_index=True)[1]
+        
+        # 有图片的行按分组稳定排序后切分，保持组内原有顺序
+        # URL 在这里整列去掉首尾空白，空字符串按无图处理，渲染时不再逐个检查
+        urls = valid_data['生成结果预览图'].astype('string').str.strip()
+        has_url = urls.str.len().gt(0).to_numpy(dtype=bool, na_value=False)
+        url_codes = codes[has_url]
+        order = np.argsort(url_codes, kind='stable')
+        counts = np.bincount(url_codes, minlength=len(first_pos))
+        bounds = np.cumsum(counts)[:-1]
+        url_lists = np.split(urls.to_numpy(dtype=object)[has_url][order], bounds)
+        saved_lists = np.split(valid_data['_saved'].to_numpy()[has_url][order], bounds)
+        
+        # 垫图和来源取每组第一行的值
+        def first_values(column):
+            if column not in valid_data.columns:
+                return [None] * len(first_pos)
+            values = valid_data[column].to_numpy(dtype=object)[first_pos]
+            values[pd.isna(values)] = None
+            return values.tolist()
+        
+        keep = np.flatnonzero(counts)
+        first_rows = valid_data.iloc[first_pos[keep]]
+        reference_imgs = first_values('指令编辑垫图')
+        enter_froms = first_values('生成来源（埋点enter_from）')
+        return pd.DataFrame({
+            'timestamp': first_rows['_ts'].to_numpy(),
+            'prompt': first_rows['prompt'].to_numpy(dtype=object),
+            'preview_url': [url_lists[i].tolist() for i in keep],
+            'reference_img': [reference_imgs[i] for i in keep],
+            'saved_images': [saved_lists[i].tolist() for i in keep],
+            'enter_from': [enter_froms[i] for i in keep],
+        }, columns=['timestamp', 'prompt', 'preview_url', 'reference_img', 'saved_images', 'enter_from'])
+    
+    def generate_analysis_view(self, results, page=1):
+        """生成分析视图HTML，聚类部分按页渲染"""
+        try:
+            if not results.get('clusters'):
+                return "没有找到可分析的数据"
+            
+            # 同一个结果对象只渲染一次，缓存中保留结果引用保证 id 不被复用
+            cached = self._view_cache.get((id(results), page))
+            if cached is not None and cached[0] is results:
+                return cached[1]
+            
+            html = "".join(self.iter_analysis_view(results, page))
+            self._view_cache.put((id(results), page), (results, html))
             return html
             
         except Exception as e:
-            print(f"生成聚类视图失败: {str(e)}")
+            logger.error(f"生成分析视图时出错: {str(e)}")
+            return f"生成视图失败: {str(e)}"
+    
+    def stream_analysis_view(self, results, page=1):
+        """流式生成分析视图，先返回统计和时间轴，再返回整页，供 Gradio 分两次刷新"""
+        try:
+            if not results.get('clusters'):
+                yield "没有找到可分析的数据"
+                return
+            
+            cached = self._view_cache.get((id(results), page))
+            if cached is not None and cached[0] is results:
+                yield cached[1]
+                return
+            
+            # 只返回两次：统计和时间轴先返回，整页聚类渲染完再返回，不再每个聚类重传一遍
+            parts = []
+            for i, section in enumerate(self.iter_analysis_view(results, page)):
+                parts.append(section)
+                if i == 1:
+                    yield "".join(parts)
+            html = "".join(parts)
+            yield html
+            self._view_cache.put((id(results), page), (results, html))
+            
+        except Exception as e:
+            logger.error(f"生成分析视图时出错: {str(e)}")
+            yield f"生成视图失败: {str(e)}"
+    
+    def iter_analysis_view(self, results, page=1):
+        """按段生成分析视图：统计、时间轴、然后当前页的每个聚类各一段"""
+        clusters = results['clusters']
+        page_ids, page, page_count = self.page_cluster_ids(results, page)
+        page_clusters = [(cid, clusters[cid]) for cid in page_ids]
+        total_prompts = results.get('total_prompts')
+        if total_prompts is None:
+            total_prompts = sum(len(prompts) for prompts in clusters.values())
+        
+        # 统计信息最先返回，样式已在页面布局中加载一次
+        yield f"""
+            <div class="section-title">
+                分析结果 (共 {total_prompts} 条Prompt，{len(clusters)} 个聚类{f'，第 {page}/{page_count} 页' if page_count > 1 else ''})
+            </div>
+            """
+        
+        # 时间轴视图（只显示最新的50条）
+        parts = ['<div class="section-title">Prompt 时间轴（最新50条）</div>']
+        append = parts.append
+        timeline = results.get('timeline') or self.build_timeline(results)
+        
+        for prompt, diff_html in timeline:
+            append(self.generate_prompt_card(prompt, diff_html=diff_html))
+        
+        # 聚类视图
+        append('<div class="section-title">Prompt 聚类分析</div>')
+        yield "".join(parts)
+        
+        for cluster_id, prompts in page_clusters:
+            # 对每个聚类的显示也限制数量，聚类内已按时间倒序排列
+            display_prompts = prompts[:50]
+            
+            parts = [f"""
+                <div class="cluster-section">
+                    <div class="cluster-header">
+                        <span class="cluster-title">聚类 {cluster_id}</span>
+                        <span class="cluster-count">共 {len(prompts)} 条Prompt {f'(显示最新50条)' if len(prompts) > 50 else ''}</span>
+                    </div>
+                """]
+            parts.extend(self.generate_prompt_card(p) for p in display_prompts)
+            parts.append("</div>")
+            yield "".join(parts)
+    
+    def page_cluster_ids(self, results, page=1):
+        """按大小从大到小取第 page 页的聚类ID，返回 (聚类ID列表, 实际页码, 总页数)"""
+        clusters = results['clusters']
+        page_count = max(1, -(-len(clusters) // _CLUSTERS_PER_PAGE))
+        page = min(max(int(page or 1), 1), page_count)
+        
+        cluster_order = results.get('cluster_order')
+        if cluster_order is not None:
+            # 分析时已按大小排好序，当前页直接切片
+            page_ids = cluster_order[(page - 1) * _CLUSTERS_PER_PAGE:page * _CLUSTERS_PER_PAGE]
+        else:
+            # 只对当前页及之前的聚类做部分排序，按大小从大到小
+            page_ids = heapq.nlargest(
+                page * _CLUSTERS_PER_PAGE,
+                clusters,
+                key=lambda cid: len(clusters[cid])
+            )[(page - 1) * _CLUSTERS_PER_PAGE:]
+        return page_ids, page, page_count
+    
+    def category_rows(self, results, page=1):
+        """聚类列表的第 page 页表格行（聚类ID、名称、数据量），返回 (行, 实际页码, 总页数)"""
+        clusters = results['clusters']
+        page_ids, page, page_count = self.page_cluster_ids(results, page)
+        rows = [[cid, f"聚类{cid}", len(clusters[cid])] for cid in page_ids]
+        return rows, page, page_count
+    
+    def order_clusters(self, clusters):
+        """按聚类大小从大到小排列聚类ID，大小相同时保持原顺序"""
+        return sorted(clusters, key=lambda cid: len(clusters[cid]), reverse=True)
+    
+    def build_timeline(self, results, limit=50):
+        """选出最新的若干条Prompt，并预先计算每条与前一条的差异HTML"""
+        display_prompts = self.select_latest_prompts(results, limit)
+        timeline = []
+        prev_prompt = None
+        for prompt in display_prompts:
+            # 相邻两条prompt完全相同时没有差异，直接跳过分词
+            if prev_prompt and prev_prompt['prompt'] != prompt['prompt']:
+                diff_html = self.generate_diff_section(prev_prompt, prompt)
+            else:
+                diff_html = ''
+            timeline.append((prompt, diff_html))
+            prev_prompt = prompt
+        return timeline
+    
+    def select_latest_prompts(self, results, limit):
+        """在 int64 时间列上用 argpartition 选出最新的若干条Prompt，按时间倒序返回"""
+        # 各聚类的行号合起来覆盖全部行，直接在整列上选择，不必先拼接
+        neg_ts = -results['sort_keys']
+        if len(neg_ts) > limit:
+            top = np.argpartition(neg_ts, limit - 1)[:limit]
+        else:
+            top = np.arange(len(neg_ts))
+        top = top[np.argsort(neg_ts[top], kind='stable')]
+        
+        row_items = results['row_items']
+        return [row_items[i] for i in top.tolist() if row_items[i] is not None]
+    
+    def get_style_html(self):
+        """返回全局样式HTML（模块常量，页面布局中只加载一次）"""
+        return _STYLE_HTML
+    
+    def generate_prompt_card(self, prompt, prev_prompt=None, diff_html=None):
+        try:
+            # 每张卡片都会经过这里，调试信息只在 DEBUG 级别时输出
+            logger.debug("生成Prompt卡片, 时间戳: %s, 生成来源: %s", prompt.get('timestamp'), prompt.get('enter_from'))
+            
+            # 用户输入的内容都需要转义后再拼接到HTML中
+            esc = HTML_ESCAPE_TABLE
+            
+            # 获取生成来源信息
+            enter_from = f'<span class="enter-from" style="color: var(--text-primary);">{str(prompt["enter_from"]).translate(esc)}</span>' if prompt.get("enter_from") else ''
+            
+            return _CARD_TMPL.substitute(
+                timestamp=format_timestamp(prompt['timestamp']).translate(esc),
+                enter_from=enter_from,
+                # 优先使用预先算好的差异，相邻两条prompt完全相同时直接跳过分词
+                diff_section=diff_html if diff_html is not None else (
+                    self.generate_diff_section(prev_prompt, prompt) if prev_prompt and prev_prompt['prompt'] != prompt['prompt'] else ''
+                ),
+                prompt_text=prompt["prompt"].translate(esc),
+                reference_section=self.generate_reference_section(prompt) if prompt.get('reference_img') and prompt['reference_img'].strip() else '',
+                image_grid=self.generate_image_grid(prompt)
+            )
+        except Exception as e:
+            logger.error(f"生成Prompt卡片时出错: {str(e)}")
+            return ""
+
+    def generate_diff_section(self, prev_prompt, curr_prompt):
+        """生成差异分析部分的HTML"""
+        return render_diff_section(prev_prompt['prompt'], curr_prompt['prompt'])
+
+    def generate_reference_section(self, prompt):
+        """生成垫图部分的HTML"""
+        if not (prompt.get('reference_img') and prompt['reference_img'].strip()):
+            return ''
+        
+        return _REFERENCE_TMPL.substitute(url=prompt['reference_img'].translate(HTML_ESCAPE_TABLE))
+
+    def generate_image_grid(self, prompt):
+        """生成图片网格的HTML，确保1*4排列"""
+        # 处理预览图URL，分组时已整理成去掉空白的URL列表，这里只兼容逗号拼接的字符串
+        preview_urls = prompt['preview_url']
+        if not isinstance(preview_urls, list):
+            if isinstance(preview_urls, str):
+                preview_urls = [url for url in map(str.strip, preview_urls.split(',')) if url]
+            else:
+                preview_urls = []
+        
+        # 处理保存状态
+        saved_images = prompt.get('saved_images', [False] * len(preview_urls))
+        if not isinstance(saved_images, list):
+            if ',' in str(saved_images):
+                saved_images = [s.strip().lower() == 'true' for s in str(saved_images).split(',')]
+            else:
+                saved_images = [saved_images] * len(preview_urls)
+        
+        # 确保只处理4张图片，按保存状态组合取整张网格的模板，一次替换完成
+        images = list(zip(preview_urls[:4], saved_images[:4]))
+        return grid_template(tuple(bool(is_saved) for _, is_saved in images)).substitute({
+            f'u{i}': url.translate(HTML_ESCAPE_TABLE) for i, (url, _) in enumerate(images)
+        })
+
+    def generate_cluster_section(self, cluster_id, prompts):
+        """生成聚类部分的HTML"""
+        try:
+            parts = [f"""
+            <div class="cluster-section">
+                <h4>聚类 {cluster_id} ({len(prompts)} 条Prompt)</h4>
+            """]
+            parts.extend(self.generate_prompt_card(p) for p in prompts)
+            parts.append("</div>")
+            return "".join(parts)
+        except Exception as e:
+            logger.error(f"生成聚类部分时出错: {str(e)}")
+            return ""
+
+    def get_enter_from_text(self, enter_from):
+        """转换来源代码为可读文本"""
+        if not enter_from:  # 如果字段为空或不存在，显示 "-"
+            return "-"
+        return _SOURCE_MAP.get(enter_from, enter_from)
+
+    def generate_cluster_view(self, prompts):
+        """生成聚类详情视图"""
+        try:
+            return "".join(self.iter_cluster_view(prompts))
+        except Exception as e:
+            logger.error(f"生成聚类视图失败: {str(e)}")
             traceback.print_exc()
             return f"生成视图失败: {str(e)}"
+    
+    def stream_cluster_view(self, prompts, first_batch=4):
+        """流式生成聚类详情视图，先返回前几张卡片，之后每次返回的内容翻倍，总共只返回几次"""
+        try:
+            parts = []
+            # 每次返回的是目前为止的完整HTML，按几何级数返回，累计传输量不超过最终大小的两倍
+            next_yield = first_batch
+            for i, section in enumerate(self.iter_cluster_view(prompts)):
+                parts.append(section)
+                if i == next_yield:
+                    yield "".join(parts)
+                    next_yield *= 2
+            yield "".join(parts)
+        except Exception as e:
+            logger.error(f"生成聚类视图失败: {str(e)}")
+            traceback.print_exc()
+            yield f"生成视图失败: {str(e)}"
+    
+    def stream_cluster_details(self, results, cluster_id):
+        """流式生成某个聚类的详情视图，同一结果里的同一聚类只渲染一次"""
+        # 与分析视图相同，缓存中保留结果引用保证 id 不被复用；重新分析会得到新的结果对象
+        cache_key = ('cluster', id(results), cluster_id)
+        cached = self._view_cache.get(cache_key)
+        if cached is not None and cached[0] is results:
+            yield cached[1]
+            return
+        
+        html = ''
+        for html in self.stream_cluster_view(results['clusters'][cluster_id]):
+            yield html
+        if not html.startswith("生成视图失败"):
+            self._view_cache.put(cache_key, (results, html))
+    
+    def iter_cluster_view(self, prompts):
+        """按段生成聚类详情视图：样式、每组一张卡片、结尾"""
+        yield _CLUSTER_STYLE_HTML
+        
+        # 按时间和Prompt分组；analyze_user 的结果已经按 (时间, prompt) 分好组，
+        # 预览图是列表，整组并入；逐图一行的原始数据才需要在这里合并
+        groups = {}
+        for prompt in prompts:
+            key = (prompt['timestamp'], prompt['prompt'])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    'timestamp': prompt['timestamp'],
+                    'prompt': prompt['prompt'],
+                    'urls': [],
+                    'saved': [],
+                    'reference_img': prompt.get('reference_img', ''),
+                    'enter_from': prompt.get('enter_from', None)  # 使用 get 方法，设置默认值为 None
+                }
+            
+            # 添加图片和保存状态
+            url = prompt['preview_url']
+            saved = prompt.get('saved_images', False)
+            if isinstance(url, list):
+                group['urls'].extend(url)
+                group['saved'].extend(saved if isinstance(saved, list) else [saved] * len(url))
+            elif isinstance(url, str) and url:
+                group['urls'].append(url.strip())
+                group['saved'].append(saved)
+        
+        # 时间一次性转换、排序并批量格式化，不再逐组调用 fromtimestamp；
+        # 整数按 Unix 秒解释，datetime 值按 UTC 解释，与 _ts 的换算方式一致
+        group_list = list(groups.values())
+        ts = pd.Series([g['timestamp'] for g in group_list])
+        if pd.api.types.is_numeric_dtype(ts):
+            ts = pd.to_datetime(ts.astype(np.int64), unit='s', utc=True)
+        else:
+            ts = pd.to_datetime(ts, utc=True)
+        order = np.argsort(ts.to_numpy(dtype='datetime64[ns]').view(np.int64), kind='stable')
+        sorted_groups = [group_list[i] for i in order]
+        # 只显示最新的若干组，时间也只格式化这部分
+        start = max(0, len(sorted_groups) - _CLUSTER_CARDS_LIMIT)
+        timestamps = ts.iloc[order[start:]].dt.tz_convert(_LOCAL_TZ).dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+        
+        yield '<div class="cluster-details">'
+        if start:
+            yield f'<div class="cluster-count">共 {len(sorted_groups)} 组，显示最新 {_CLUSTER_CARDS_LIMIT} 组</div>'
+        
+        for i in range(start, len(sorted_groups)):
+            group = sorted_groups[i]
+            timestamp = timestamps[i - start]
+            source_text = self.get_enter_from_text(group.get('enter_from'))  # 使用 get 方法获取来源
+            
+            # 生成差异分析
+            diff_html = ''
+            # 与上一条完全相同的prompt没有差异，跳过分词
+            if i > 0 and sorted_groups[i-1]['prompt'] != group['prompt']:
+                diff_html = render_cluster_diff_section(sorted_groups[i-1]['prompt'], group['prompt'])
+            
+            # 生成图片网格
+            grid_html = '<div class="image-grid">' + ''.join(
+                _CLUSTER_IMAGE_TMPLS[bool(saved)].substitute(url=url.translate(HTML_ESCAPE_TABLE))
+                for url, saved in zip(group['urls'][:4], group['saved'][:4])  # 限制最多4张图
+            ) + '</div>'
+            
+            yield _CLUSTER_CARD_TMPL.substitute(
+                timestamp=timestamp,
+                source_text=str(source_text).translate(HTML_ESCAPE_TABLE),
+                image_count=len(group['urls']),
+                diff_html=diff_html,
+                prompt_text=group['prompt'].translate(HTML_ESCAPE_TABLE),
+                grid_html=grid_html,
+                reference_section=_CLUSTER_REFERENCE_TMPL.substitute(
+                    url=str(group['reference_img']).translate(HTML_ESCAPE_TABLE)
+                ) if group.get('reference_img') else ''
+            )
+        
+        yield "</div>"
 
 def create_ui():
     app = PromptAnalysisApp()
-    version = int(time.time() / 3600)
     
     with gr.Blocks(
         theme=gr.themes.Base(),
-        css=f".gradio-app {{ --app-version: {version}; }}"
+        css=_BLOCKS_CSS
     ) as interface:
         # 添加类名到根元素
-        gr.HTML(f'<div class="gradio-app-{version}">')
-        gr.HTML(app.get_style_html())
+        gr.HTML(_ROOT_OPEN_HTML)
+        # 全局样式只在布局中加载一次，视图不再重复携带
+        gr.HTML(value=_STYLE_HTML, visible=True)
         
         gr.Markdown("# Prompt 分析工具")
         
@@ -788,6 +1281,12 @@ def create_ui():
             interactive=False
         )
         
+        # 每个会话保存预先渲染好的聚类详情HTML
+        cluster_html_state = gr.State({})
+        
+        # 每个会话保存自己的聚类结果，翻页时直接从中取
+        results_state = gr.State({})
+        
         # 3. 垂类表格（初始隐藏）
         category_table = gr.Dataframe(
             headers=["垂类ID", "垂类名称", "数据量"],
@@ -796,6 +1295,13 @@ def create_ui():
             visible=False
         )
         
+        # 聚类较多时分页显示
+        cluster_page = gr.Number(
+            value=1,
+            precision=0,
+            label="聚类页码"
+        )
+        
         # 4. 结果展示
         analysis_result = gr.HTML(label="分析结果")
 
@@ -805,11 +1311,10 @@ def create_ui():
                 if file is None:
                     return gr.update(choices=[], value=None), "请先上传CSV文件"
                     
-                app.df = pd.read_csv(file.name)
-                app.df['用户UID'] = app.df['用户UID'].astype(str)
-                unique_users = app.df['用户UID'].unique().tolist()
+                # 与 load_data 共用同一个加载入口和数据缓存
+                unique_users = app.load_csv(file.name)
                 
-                print(f"成功加载CSV文件，共有 {len(unique_users)} 个用户")
+                logger.info("成功加载CSV文件，共有 %d 个用户", len(unique_users))
                 return (
                     gr.update(
                         choices=unique_users,
@@ -818,32 +1323,47 @@ def create_ui():
                     "文件加载成功，请选择用户并点击分析"
                 )
             except Exception as e:
-                print(f"文件加载错误: {str(e)}")
+                logger.error(f"文件加载错误: {str(e)}")
                 return gr.update(choices=[], value=None), f"文件加载失败: {str(e)}"
 
-        def handle_analyze_click(user_id):
+        async def handle_analyze_click(user_id):
+            # 协程在事件循环上运行，只把耗时的筛选和聚类放到线程中，状态更新不再占用线程池
             try:
                 if app.df is None:
-                    return (
+                    yield (
                         gr.update(value=None, visible=False),
-                        "请先上传CSV文件"
+                        "请先上传CSV文件",
+                        {},
+                        gr.update(),
+                        {}
                     )
+                    return
                 
                 if not user_id:
-                    return (
+                    yield (
                         gr.update(value=None, visible=False),
-                        "请选择用户"
+                        "请选择用户",
+                        {},
+                        gr.update(),
+                        {}
                     )
+                    return
                 
-                user_data = app.df[app.df['用户UID'].astype(str) == str(user_id)]
+                # 通过设置数据时建好的用户索引直接取行，不再整列比较
+                data_key, user_data = await anyio.to_thread.run_sync(app.get_user_data_with_key, user_id)
                 if len(user_data) == 0:
-                    return (
+                    yield (
                         gr.update(value=None, visible=False),
-                        f"未找到用户 {user_id} 的数据"
+                        f"未找到用户 {user_id} 的数据",
+                        {},
+                        gr.update(),
+                        {}
                     )
+                    return
                 
-                # 打印调试信息
-                print("DataFrame 列名:", user_data.columns.tolist())
+                # 调试信息只在 DEBUG 级别时才构造
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("DataFrame 列名: %s", user_data.columns.tolist())
                 
                 # 准备基础数据
                 analysis_data = {
@@ -866,51 +1386,100 @@ def create_ui():
                 # 转换为DataFrame
                 analysis_data = pd.DataFrame(analysis_data)
                 
-                # 分析数据并保存结果
-                app.current_results = app.analyzer.analyze_user_prompts(analysis_data, str(user_id))
-                if not app.current_results or 'clusters' not in app.current_results:
-                    return (
+                # 聚类耗时较长，先把进度返回给界面
+                yield (
+                    gr.update(),
+                    f"找到用户 {user_id} 的 {len(analysis_data)} 条数据，正在聚类...",
+                    gr.update(),
+                    gr.update(),
+                    {}
+                )
+                
+                # 分析数据，结果保存在本会话的状态中，不写入多个会话共用的 current_results
+                # 逐行聚类的结果和 analyze_user 的分组结果不同，缓存键中加上 'raw' 区分
+                # 首次调用时 analyzer 可能还在等待模型加载，也一并放到线程中
+                def analyze_raw_rows():
+                    results = app.analyzer.analyze_user_prompts(analysis_data, str(user_id))
+                    if results and 'clusters' in results:
+                        # 按大小排好聚类顺序，翻页时直接切片；放入缓存前算好，缓存的结果不再修改
+                        results['cluster_order'] = app.order_clusters(results['clusters'])
+                    return results
+                
+                results = await anyio.to_thread.run_sync(
+                    app.cached_result, (data_key, 'raw', str(user_id)), analyze_raw_rows
+                )
+                if not results or 'clusters' not in results:
+                    yield (
                         gr.update(value=None, visible=False),
-                        "分析结果为空"
+                        "分析结果为空",
+                        {},
+                        gr.update(),
+                        {}
                     )
+                    return
                 
-                # 将聚类结果转换为表格格式
-                category_rows = []
-                for cluster_id, prompts in app.current_results['clusters'].items():
-                    category_rows.append([
-                        cluster_id,  # 直接使用数字作为聚类ID
-                        f"聚类{cluster_id}",  # 聚类名称
-                        len(prompts)  # 该聚类中的数据量
-                    ])
-                
-                # 按数据量排序（可选）
-                category_rows.sort(key=lambda x: x[2], reverse=True)
+                # 表格只显示第一页的聚类，其余通过页码翻看
+                category_rows, page, page_count = app.category_rows(results, 1)
                 
                 if not category_rows:
-                    return (
+                    yield (
                         gr.update(value=None, visible=False),
-                        f"用户 {user_id} 暂无数据"
+                        f"用户 {user_id} 暂无数据",
+                        {},
+                        gr.update(),
+                        {}
                     )
+                    return
                     
-                return (
+                yield (
                     gr.update(value=category_rows, visible=True),
-                    f"找到用户 {user_id} 的数据，请点击聚类查看详情"
+                    f"找到用户 {user_id} 的 {len(results['clusters'])} 个聚类（共 {page_count} 页），请点击聚类查看详情",
+                    results,
+                    gr.update(value=page),
+                    {}
                 )
             except Exception as e:
-                print(f"分析错误: {str(e)}")
+                logger.error(f"分析错误: {str(e)}")
                 traceback.print_exc()
-                return (
+                yield (
                     gr.update(value=None, visible=False),
-                    f"分析失败: {str(e)}"
+                    f"分析失败: {str(e)}",
+                    {},
+                    gr.update(),
+                    {}
                 )
 
-        def handle_category_select(evt: gr.SelectData, user_id):
+        def handle_page_change(results, page):
+            """页码变化时从会话结果中取对应页的聚类，只更新表格"""
+            # 分析完成时重置页码也会触发这里，不改动状态栏，避免覆盖分析给出的提示
+            if not results or 'clusters' not in results:
+                return gr.update()
+            category_rows, page, page_count = app.category_rows(results, page)
+            return gr.update(value=category_rows, visible=True)
+
+        def prerender_cluster_views(results):
+            """分析完成后预先渲染最大的几个聚类详情，选择这些聚类时只需查表"""
+            if not results or 'clusters' not in results:
+                return {}
+            # 只渲染最大的几个聚类，其余聚类在点击时再渲染
+            cluster_html = {}
+            for cluster_id in results['cluster_order'][:_PRERENDER_CLUSTERS]:
+                html = app.generate_cluster_view(results['clusters'][cluster_id])
+                # 大聚类只在会话状态里保存 iframe，详情走文件接口
+                if len(html) > _INLINE_HTML_LIMIT:
+                    html = publish_cluster_html(html)
+                cluster_html[cluster_id] = html
+            return cluster_html
+
+        def handle_category_select(evt: gr.SelectData, user_id, cluster_html, results):
             try:
                 if app.df is None:
-                    return "请先上传CSV文件"
+                    yield "请先上传CSV文件"
+                    return
                 
                 if not user_id:
-                    return "请选择用户"
+                    yield "请选择用户"
+                    return
                 
                 # 获取选中行的聚类ID
                 try:
@@ -932,37 +1501,47 @@ def create_ui():
                     else:
                         raise ValueError(f"无法处理的值类型: {type(evt.value)}")
                 except Exception as e:
-                    print(f"提取聚类ID时出错: {str(e)}")
-                    print(f"evt.value: {evt.value}, 类型: {type(evt.value)}")
+                    logger.error(f"提取聚类ID时出错: {str(e)}")
+                    logger.debug("evt.value: %s, 类型: %s", evt.value, type(evt.value))
                     # 尝试使用 evt.index
                     cluster_id = evt.index
                 
-                print(f"查看用户 {user_id} 的聚类 {cluster_id} 详情")
+                logger.debug("查看用户 %s 的聚类 %s 详情", user_id, cluster_id)
+                
+                # 已预先渲染的聚类直接返回
+                if cluster_html and cluster_id in cluster_html:
+                    yield cluster_html[cluster_id]
+                    return
                 
-                # 获取当前的聚类结果
-                if not hasattr(app, 'current_results') or not app.current_results:
-                    return "请先进行聚类分析"
+                # 获取本会话的聚类结果
+                if not results or 'clusters' not in results:
+                    yield "请先进行聚类分析"
+                    return
                 
                 # 生成选中聚类的视图
-                if cluster_id not in app.current_results['clusters']:
-                    return f"未找到聚类 {cluster_id} 的数据"
+                if cluster_id not in results['clusters']:
+                    yield f"未找到聚类 {cluster_id} 的数据"
+                    return
                 
-                cluster_prompts = app.current_results['clusters'][cluster_id]
-                return app.generate_cluster_view(cluster_prompts)
+                # 分批返回卡片，先显示已经渲染好的部分；重复选择同一聚类直接返回缓存
+                yield from app.stream_cluster_details(results, cluster_id)
                 
             except Exception as e:
-                print(f"显示聚类详情时出错: {str(e)}")
+                logger.error(f"显示聚类详情时出错: {str(e)}")
                 traceback.print_exc()
-                return f"显示详情失败: {str(e)}"
+                yield f"显示详情失败: {str(e)}"
 
         # 绑定事件
+        # 上传、分析和详情查看各走各的并发通道，慢上传不会占住分析和详情查看的 worker
         file_input.change(
             fn=handle_file_upload,
             inputs=[file_input],
             outputs=[
                 user_dropdown,
                 status_text
-            ]
+            ],
+            concurrency_limit=_UPLOAD_CONCURRENCY,
+            concurrency_id="upload"
         )
         
         analyze_btn.click(
@@ -970,19 +1549,43 @@ def create_ui():
             inputs=[user_dropdown],
             outputs=[
                 category_table,
-                status_text
-            ]
+                status_text,
+                results_state,
+                cluster_page,
+                # 新的分析开始时清空上一次预渲染的详情，避免点击到上一个用户的同号聚类
+                cluster_html_state
+            ],
+            concurrency_limit=_QUEUE_CONCURRENCY,
+            concurrency_id="analyze"
+        ).then(
+            fn=prerender_cluster_views,
+            inputs=[results_state],
+            outputs=[cluster_html_state],
+            concurrency_limit=_DETAILS_CONCURRENCY,
+            concurrency_id="details"
+        )
+        
+        cluster_page.change(
+            fn=handle_page_change,
+            inputs=[results_state, cluster_page],
+            outputs=[category_table],
+            concurrency_limit=_DETAILS_CONCURRENCY,
+            concurrency_id="details"
         )
         
         category_table.select(
             fn=handle_category_select,
-            inputs=[user_dropdown],
-            outputs=[analysis_result]
+            inputs=[user_dropdown, cluster_html_state, results_state],
+            outputs=[analysis_result],
+            concurrency_limit=_DETAILS_CONCURRENCY,
+            concurrency_id="details"
         )
 
         # 关闭根div
         gr.HTML('</div>')
 
+    # 开启队列，多个用户的分析请求在线程池中并发处理，不再互相阻塞
+    interface.queue(default_concurrency_limit=_QUEUE_CONCURRENCY, max_size=32)
     return interface
 
 if __name__ == "__main__":
@@ -990,6 +1593,10 @@ if __name__ == "__main__":
     interface.launch(
         server_name="0.0.0.0",
         server_port=7860,
+        share=_SHARE,
         show_error=True,
         ssl_verify=False,
+        allowed_paths=[_CLUSTER_HTML_DIR],
+        debug=False,
+        max_threads=_MAX_THREADS,
     ) 
\ No newline at end of file
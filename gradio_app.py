@@ -1,8 +1,62 @@
 import gradio as gr
+import anyio
 import pandas as pd
-from app import PromptAnalysisApp
+from app import (PromptAnalysisApp, _STYLE_HTML, _QUEUE_CONCURRENCY, _UPLOAD_CONCURRENCY,
+                 _DETAILS_CONCURRENCY, _MAX_THREADS, _SHARE)
 import traceback
 import time
+from functools import lru_cache
+
+@lru_cache(maxsize=2)
+def _dark_theme_style(version):
+    """生成带版本号的暗色主题样式"""
+    return f"""
+    <style data-version="{version}">
+    :root {{
+        --background-base: #000000;
+        --background-primary: #1a1a1a;
+        --background-secondary: #2d2d2d;
+        --text-primary: #ffffff;
+        --text-secondary: #e0e0e0;
+        --border-color: #404040;
+    }}
+
+    /* 添加命名空间避免样式冲突 */
+    .gradio-app-{version} {{
+        background-color: var(--background-base) !important;
+    }}
+
+    .gradio-app-{version} .gr-box {{
+        background-color: var(--background-primary) !important;
+        border-color: var(--border-color) !important;
+    }}
+
+    .gradio-app-{version} table {{
+        background-color: var(--background-primary) !important;
+    }}
+
+    .gradio-app-{version} th {{
+        background-color: var(--background-secondary) !important;
+        color: var(--text-primary) !important;
+    }}
+
+    .gradio-app-{version} td {{
+        color: var(--text-secondary) !important;
+    }}
+
+    .gradio-app-{version} label, 
+    .gradio-app-{version} .gr-text {{
+        color: var(--text-primary) !important;
+    }}
+    </style>
+
+    <script>
+    // 强制刷新样式
+    document.addEventListener('DOMContentLoaded', function() {{
+        document.querySelector('.gradio-container').classList.add('gradio-app-{version}');
+    }});
+    </script>
+    """
 
 class GradioInterface:
     def __init__(self):
@@ -11,6 +65,7 @@ class GradioInterface:
     def create_interface(self):
         with gr.Blocks(theme=gr.themes.Base()) as interface:
             gr.HTML(self.get_dark_theme_style())
+            gr.HTML(value=_STYLE_HTML, visible=True)
             
             gr.Markdown("# Prompt 分析工具")
             
@@ -40,6 +95,16 @@ class GradioInterface:
                 visible=False
             )
             
+            # 聚类较多时分页显示
+            cluster_page = gr.Number(
+                value=1,
+                precision=0,
+                label="聚类页码"
+            )
+            
+            # 每个会话保存当前垂类的分析结果，翻页时直接从中取
+            results_state = gr.State({})
+            
             # 3. 结果展示
             analysis_result = gr.HTML(label="分析结果")
             
@@ -55,104 +120,121 @@ class GradioInterface:
             def handle_analyze_click(user_id):
                 try:
                     if self.app.df is None:
-                        return gr.Dataframe.update(value=None, visible=False), "请先上传CSV文件"
+                        return gr.update(value=None, visible=False), "请先上传CSV文件"
                     
                     if not user_id or not user_id.strip():
-                        return gr.Dataframe.update(value=None, visible=False), "请输入用户ID"
+                        return gr.update(value=None, visible=False), "请输入用户ID"
                     
                     user_id = str(user_id).strip()
                     print(f"正在分析用户: {user_id}")
                     
-                    user_data = self.app.df[self.app.df['用户UID'].astype(str) == user_id]
+                    # 通过预建的用户索引取数据，不再整列转换和比较
+                    user_data = self.app.get_user_data(user_id)
                     if len(user_data) == 0:
-                        return gr.Dataframe.update(value=None, visible=False), f"未找到用户 {user_id} 的数据"
+                        return gr.update(value=None, visible=False), f"未找到用户 {user_id} 的数据"
                     
                     print(f"找到用户数据 {len(user_data)} 条")
                     
                     # 获取用户的垂类数据
-                    category_data = user_data.groupby('聚类ID').size().reset_index()
-                    category_data.columns = ['聚类ID', '数据量']
-                    
-                    # 转换为列表格式
-                    category_rows = []
-                    for _, row in category_data.iterrows():
-                        category_rows.append([
-                            str(row['聚类ID']),
-                            "垂类" + str(row['聚类ID']),
-                            str(row['数据量'])
-                        ])
+                    category_counts = user_data.groupby('聚类ID').size()
+                    
+                    # 整列转成字符串后一次性转为列表，不再逐行 iterrows
+                    category_ids = category_counts.index.astype(str)
+                    category_rows = pd.DataFrame({
+                        '垂类ID': category_ids,
+                        '垂类名称': "垂类" + category_ids,
+                        '数据量': category_counts.astype(str).to_numpy()
+                    }).values.tolist()
                     
                     if not category_rows:
-                        return gr.Dataframe.update(value=None, visible=False), f"用户 {user_id} 暂无数据"
+                        return gr.update(value=None, visible=False), f"用户 {user_id} 暂无数据"
                         
                     # 只返回两个值：表格更新和状态消息
-                    return gr.Dataframe.update(value=category_rows, visible=True), f"找到用户 {user_id} 的数据"
+                    return gr.update(value=category_rows, visible=True), f"找到用户 {user_id} 的数据"
                 except Exception as e:
                     print(f"分析错误: {str(e)}")
                     traceback.print_exc()
-                    return gr.Dataframe.update(value=None, visible=False), f"分析失败: {str(e)}"
+                    return gr.update(value=None, visible=False), f"分析失败: {str(e)}"
 
-            def handle_category_select(evt: gr.SelectData, user_id):
+            async def handle_category_select(evt: gr.SelectData, user_id, page=1, categories=None):
+                # 协程在事件循环上运行，筛选、聚类和每一段渲染都放到线程中，多个会话可以交替推进
                 try:
                     if self.app.df is None:
-                        return (
-                            gr.update(value=None),  # 保持表格不变
-                            "请先上传CSV文件"  # 状态消息
-                        )
+                        yield "请先上传CSV文件", {}
+                        return
                     
                     if not user_id or not user_id.strip():
-                        return (
-                            gr.update(value=None),
-                            "请先输入用户ID"
-                        )
+                        yield "请先输入用户ID", {}
+                        return
                     
                     user_id = str(user_id).strip()
                     
-                    # 从选中行获取垂类ID
-                    selected_id = evt.index[0]  # 使用 index 获取选中行的索引
-                    category_id = evt.data[0]  # 获取该行第一列的值（垂类ID）
+                    # 从选中行获取垂类ID：按 index 取表格中该行第一列的值，点击任意单元格都可以
+                    selected_id = evt.index[0]
+                    if categories is not None and len(categories) > selected_id:
+                        category_id = categories.iloc[selected_id, 0]
+                    else:
+                        category_id = evt.value
                     
                     print(f"分析用户 {user_id} 的垂类 {category_id}")
                     
-                    category_df = self.app.df[
-                        (self.app.df['聚类ID'] == int(category_id)) & 
-                        (self.app.df['用户UID'].astype(str) == user_id)
-                    ]
+                    # 先按用户索引取出该用户的行，只在这部分数据上比较垂类
+                    def select_category_rows():
+                        data_key, user_data = self.app.get_user_data_with_key(user_id)
+                        return data_key, user_data[user_data['聚类ID'] == int(category_id)]
+                    
+                    data_key, category_df = await anyio.to_thread.run_sync(select_category_rows)
                     
                     print(f"找到 {len(category_df)} 条数据")
                     
                     if len(category_df) == 0:
-                        return (
-                            gr.update(value=None),
-                            f"用户 {user_id} 在垂类 {category_id} 下暂无数据"
-                        )
+                        yield f"用户 {user_id} 在垂类 {category_id} 下暂无数据", {}
+                        return
                     
-                    results = self.app.analyze_user_prompts(category_df)
+                    # 同一份数据中同一用户、同一垂类的结果复用缓存，再次点击不重新聚类
+                    cache_key = (data_key, user_id, int(category_id))
+                    results = await anyio.to_thread.run_sync(
+                        lambda: self.app.analyze_rows(category_df, user_id, cache_key=cache_key)
+                    )
+                    if isinstance(results, str):
+                        yield results, {}
+                        return
                     if not results:
-                        return (
-                            gr.update(value=None),
-                            "分析结果为空"
-                        )
+                        yield "分析结果为空", {}
+                        return
                         
-                    analysis_view = self.app.generate_analysis_view(results)
-                    return (
-                        gr.update(value=None),  # 保持表格不变
-                        analysis_view  # 显示分析结果
-                    )
+                    # 分段流式返回分析视图，先显示样式和统计信息
+                    views = self.app.stream_analysis_view(results, page)
+                    while True:
+                        analysis_view = await anyio.to_thread.run_sync(next, views, None)
+                        if analysis_view is None:
+                            break
+                        yield analysis_view, results
                     
                 except Exception as e:
                     print(f"分析错误: {str(e)}")
                     traceback.print_exc()
-                    return (
-                        gr.update(value=None),
-                        f"分析失败: {str(e)}"
-                    )
+                    yield f"分析失败: {str(e)}", {}
+
+            async def handle_page_change(results, page):
+                # 页码变化时用会话中保存的结果重新渲染，不再重新聚类
+                if not results or 'clusters' not in results:
+                    return
+                views = self.app.stream_analysis_view(results, page)
+                while True:
+                    analysis_view = await anyio.to_thread.run_sync(next, views, None)
+                    if analysis_view is None:
+                        break
+                    yield analysis_view
 
             # 绑定事件
+            # 上传、分析和详情查看各走各的并发通道，慢上传不会占住其他用户的分析和详情查看
             file_input.change(
                 fn=handle_file_upload,
                 inputs=[file_input],
-                outputs=[upload_status]  # 改为使用新的状态文本组件
+                outputs=[upload_status],  # 改为使用新的状态文本组件
+                concurrency_limit=_UPLOAD_CONCURRENCY,
+                concurrency_id="upload"
             )
             
             analyze_btn.click(
@@ -161,70 +243,35 @@ class GradioInterface:
                 outputs=[
                     category_table,
                     analysis_result  # 用于显示状态消息
-                ]
+                ],
+                concurrency_limit=_QUEUE_CONCURRENCY,
+                concurrency_id="analyze"
             )
             
             category_table.select(
                 fn=handle_category_select,
-                inputs=[category_table, user_id],
-                outputs=[
-                    category_table,  # 保持表格状态
-                    analysis_result  # 显示分析结果或错误消息
-                ]
+                inputs=[user_id, cluster_page, category_table],
+                # 表格本身不需要更新，只输出分析结果，避免每次刷新都回传表格
+                outputs=[analysis_result, results_state],
+                concurrency_limit=_DETAILS_CONCURRENCY,
+                concurrency_id="details"
+            )
+            
+            cluster_page.change(
+                fn=handle_page_change,
+                inputs=[results_state, cluster_page],
+                outputs=[analysis_result],
+                concurrency_limit=_DETAILS_CONCURRENCY,
+                concurrency_id="details"
             )
 
+        # 开启队列，多个用户的分析请求在线程池中并发处理，不再互相阻塞
+        interface.queue(default_concurrency_limit=_QUEUE_CONCURRENCY, max_size=32)
         return interface
 
     def get_dark_theme_style(self):
-        # 添加时间戳作为版本号
-        version = int(time.time())
-        return f"""
-        <style data-version="{version}">
-        :root {{
-            --background-base: #000000;
-            --background-primary: #1a1a1a;
-            --background-secondary: #2d2d2d;
-            --text-primary: #ffffff;
-            --text-secondary: #e0e0e0;
-            --border-color: #404040;
-        }}
-
-        /* 添加命名空间避免样式冲突 */
-        .gradio-app-{version} {{
-            background-color: var(--background-base) !important;
-        }}
-
-        .gradio-app-{version} .gr-box {{
-            background-color: var(--background-primary) !important;
-            border-color: var(--border-color) !important;
-        }}
-
-        .gradio-app-{version} table {{
-            background-color: var(--background-primary) !important;
-        }}
-
-        .gradio-app-{version} th {{
-            background-color: var(--background-secondary) !important;
-            color: var(--text-primary) !important;
-        }}
-
-        .gradio-app-{version} td {{
-            color: var(--text-secondary) !important;
-        }}
-
-        .gradio-app-{version} label, 
-        .gradio-app-{version} .gr-text {{
-            color: var(--text-primary) !important;
-        }}
-        </style>
-
-        <script>
-        // 强制刷新样式
-        document.addEventListener('DOMContentLoaded', function() {{
-            document.querySelector('.gradio-container').classList.add('gradio-app-{version}');
-        }});
-        </script>
-        """
+        # 版本号按小时变化，同一小时内复用已生成的样式
+        return _dark_theme_style(int(time.time() // 3600))
 
 if __name__ == "__main__":
     interface = GradioInterface()
@@ -232,5 +279,8 @@ if __name__ == "__main__":
     demo.launch(
         server_name="0.0.0.0", 
         server_port=7860,
-        show_error=True
+        share=_SHARE,
+        show_error=True,
+        debug=False,
+        max_threads=_MAX_THREADS
     ) 
\ No newline at end of file
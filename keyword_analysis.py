@@ -1,29 +1,91 @@
 from keybert import KeyBERT
 from sentence_transformers import SentenceTransformer
 from sklearn.cluster import DBSCAN
+from scipy.linalg.blas import ssyrk
 import numpy as np
 import pandas as pd
 from difflib import SequenceMatcher
+from functools import lru_cache
+from collections import OrderedDict
+from operator import itemgetter
 import json
 from datetime import datetime
 import os
 import warnings
 import os
 import jieba
+import threading
+import torch
+import logging
 
 # 设置环境变量以避免tokenizers警告
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+# jieba 词典在第一次分词时才加载；构建好的前缀词典缓存放到固定目录，重启后直接读取，
+# 不随系统临时目录被清理而重新构建。目录在 init_jieba 中创建，导入模块时不写磁盘
+JIEBA_CACHE_DIR = os.environ.get(
+    "JIEBA_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "prompt_analyser")
+)
+
+logger = logging.getLogger(__name__)
+
+# HTML 转义表，用 str.translate 一次遍历完成转义
+HTML_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;'
+})
+
 class PromptAnalyzer:
     def __init__(self):
         # 禁用警告
         warnings.filterwarnings('ignore')
         try:
             self.kw_model = KeyBERT()
-            self.st_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+            # 有 GPU 时放到 GPU 上并用半精度推理，CPU 上保持 FP32
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            self.st_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2', device=device)
+            if device == 'cuda':
+                self.st_model.half()
         except Exception as e:
             print(f"初始化模型时出错: {str(e)}")
             raise
+        # 按prompt文本缓存embedding，重复的prompt只计算一次
+        self._embedding_cache = OrderedDict()
+        self._embedding_lock = threading.Lock()
+    
+    def encode_prompts(self, prompts, cache_size=20000):
+        """计算归一化后的prompts embeddings，相同文本只编码一次，并复用之前算过的结果"""
+        codes, unique_prompts = pd.factorize(pd.Series(prompts, dtype=object))
+        # 空值的编码是 -1，按下标展开时会取到最后一个 embedding，这里直接拒绝
+        if (codes < 0).any():
+            raise ValueError("prompts 中包含空值")
+        cache = self._embedding_cache
+        with self._embedding_lock:
+            found = {p: cache[p] for p in unique_prompts if p in cache}
+        # 编码不持有锁，其他请求可以同时读取缓存
+        missing = [p for p in unique_prompts if p not in found]
+        if missing:
+            # 模型内部会按长度排序分批，这里加大批量并直接输出单位向量
+            found.update(zip(missing, self.st_model.encode(
+                missing,
+                batch_size=128,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            ).astype(np.float32, copy=False)))
+        with self._embedding_lock:
+            for prompt in unique_prompts:
+                cache[prompt] = found[prompt]
+                cache.move_to_end(prompt)
+            while len(cache) > cache_size:
+                cache.popitem(last=False)
+        unique_embeddings = [found[p] for p in unique_prompts]
+        # 按原顺序展开回每一条prompt
+        return np.asarray(unique_embeddings)[codes]
         
     def extract_keywords(self, prompt):
         """提取关键词及其权重"""
@@ -33,47 +95,43 @@ class PromptAnalyzer:
     def cluster_prompts(self, prompts, similarity_threshold=0.9):
         """基于相似度阈值对prompts进行聚类"""
         try:
-            print(f"开始对 {len(prompts)} 条prompt进行聚类，相似度阈值: {similarity_threshold}")
+            logger.info("开始对 %d 条prompt进行聚类，相似度阈值: %s", len(prompts), similarity_threshold)
             
             # 计算embeddings
-            embeddings = self.st_model.encode(prompts)
-            print("Embeddings计算完成")
+            embeddings = self.encode_prompts(prompts)
+            logger.debug("Embeddings计算完成")
+            
+            # embeddings 已归一化，余弦相似度就是 E·Eᵀ；下面只用到上三角，
+            # 用对称秩 k 更新 (syrk) 只算上三角，计算量减半
+            similarity_matrix = ssyrk(1.0, embeddings)
             
-            # 计算相似度矩阵
-            from sklearn.metrics.pairwise import cosine_similarity
-            similarity_matrix = cosine_similarity(embeddings)
+            # 一次比较得到整张阈值矩阵（只有上三角有效），不再逐对在 Python 中比较
+            similar = similarity_matrix >= similarity_threshold
             
-            # 基于相似度阈值进行聚类
+            # 基于相似度阈值进行聚类：按顺序取未归类的prompt作为中心，
+            # 与它相似且未归类的prompt一起组成新聚类；中心之前的prompt都已归类，只看之后的部分
             clusters = {}
-            used_indices = set()
+            assigned = np.zeros(len(prompts), dtype=bool)
+            debug = logger.isEnabledFor(logging.DEBUG)
             
             for i in range(len(prompts)):
-                if i in used_indices:
+                if assigned[i]:
                     continue
-                    
-                # 找到与当前prompt相似度高于阈值的所有prompts
-                similar_indices = set([i])
-                for j in range(len(prompts)):
-                    if j != i and j not in used_indices:
-                        similarity = similarity_matrix[i][j]
-                        if similarity >= similarity_threshold:
-                            print(f"找到相似Prompt: {i} 和 {j} 的相似度为 {similarity:.3f}")
-                            similar_indices.add(j)
                 
-                # 如果找到相似的prompts，创建新的聚类
-                if similar_indices:
-                    cluster_id = len(clusters)
-                    clusters[cluster_id] = list(similar_indices)
-                    used_indices.update(similar_indices)
-                    print(f"创建聚类 {cluster_id}，包含 {len(similar_indices)} 条Prompt")
-            
-            print(f"聚类完成，共有 {len(clusters)} 个聚类")
+                members = i + 1 + np.flatnonzero(similar[i, i + 1:] & ~assigned[i + 1:])
+                members = np.concatenate(([i], members))
+                assigned[members] = True
+                
+                cluster_id = len(clusters)
+                clusters[cluster_id] = members.tolist()
+                if debug:
+                    logger.debug("创建聚类 %d，包含 %d 条Prompt", cluster_id, len(members))
+            
+            logger.info("聚类完成，共有 %d 个聚类", len(clusters))
             return clusters
             
         except Exception as e:
-            print(f"聚类过程出错: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("聚类过程出错: %s", e)
             return None
     
     def track_prompt_changes(self, prompts, timestamps):
@@ -117,20 +175,26 @@ class PromptAnalyzer:
     def analyze_user_prompts(self, df, user_id):
         """分析用户的prompts"""
         try:
-            print(f"开始分析用户 {user_id} 的 {len(df)} 条prompt")
-            print(f"DataFrame 列名: {df.columns.tolist()}")
+            # 每次分析都会经过这里，调试信息用日志参数延迟格式化
+            logger.info("开始分析用户 %s 的 %d 条prompt", user_id, len(df))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("DataFrame 列名: %s", df.columns.tolist())
             
             # 验证必要的列
             required_columns = ['prompt', 'timestamp', 'preview_url']
             if not all(col in df.columns for col in required_columns):
                 missing = [col for col in required_columns if col not in df.columns]
-                print(f"缺少必要的列: {missing}")
+                logger.warning("缺少必要的列: %s", missing)
                 return None
             
+            # 去掉空的prompt，行号重新从 0 开始，与聚类下标一致
+            if df['prompt'].isna().any():
+                df = df[df['prompt'].notna()].reset_index(drop=True)
+            
             # 获取有效的prompts
             valid_prompts = df['prompt'].tolist()
             if not valid_prompts:
-                print("没有有效的prompts")
+                logger.warning("没有有效的prompts")
                 return None
             
             # 执行聚类
@@ -138,38 +202,62 @@ class PromptAnalyzer:
             if cluster_indices is None:
                 return None
             
-            # 构建聚类结果
+            # 按列取出数据（SoA），不再对每一行调用 df.iloc 构造 Series
+            n = len(df)
+            sort_keys = timestamp_sort_keys(df['timestamp'])
+            columns = {
+                'prompt': valid_prompts,
+                'timestamp': df['timestamp'].tolist(),
+                'preview_url': df['preview_url'].tolist(),
+                'saved_images': df['saved_images'].tolist() if 'saved_images' in df.columns else [False] * n,
+            }
+            enter_from_col = df['enter_from'].tolist() if 'enter_from' in df.columns else None
+            if 'reference_img' in df.columns:
+                reference_col = df['reference_img'].tolist()
+                has_reference = df['reference_img'].notna().to_numpy()
+            else:
+                reference_col = None
+            
+            # 构建聚类结果，聚类内按时间倒序排列，后续视图不必再排序
             clusters = {}
+            row_items = [None] * n
             for cluster_id, indices in cluster_indices.items():
-                clusters[cluster_id] = []
-                for idx in indices:
-                    prompt_data = df.iloc[idx]
+                indices = np.asarray(indices, dtype=np.int64)
+                rows = indices[np.argsort(-sort_keys[indices], kind='stable')]
+                
+                items = []
+                for idx in rows.tolist():
                     cluster_item = {
-                        'prompt': prompt_data['prompt'],
-                        'timestamp': prompt_data['timestamp'],
-                        'preview_url': prompt_data['preview_url'],
-                        'saved_images': prompt_data.get('saved_images', False),
+                        'prompt': columns['prompt'][idx],
+                        'timestamp': columns['timestamp'][idx],
+                        'preview_url': columns['preview_url'][idx],
+                        'saved_images': columns['saved_images'][idx],
                     }
                     
                     # 只在字段存在时添加
-                    if 'enter_from' in prompt_data:
-                        cluster_item['enter_from'] = prompt_data['enter_from']
+                    if enter_from_col is not None:
+                        cluster_item['enter_from'] = enter_from_col[idx]
                         
-                    if 'reference_img' in prompt_data and pd.notna(prompt_data['reference_img']):
-                        cluster_item['reference_img'] = prompt_data['reference_img']
+                    if reference_col is not None and has_reference[idx]:
+                        cluster_item['reference_img'] = reference_col[idx]
                     
-                    clusters[cluster_id].append(cluster_item)
+                    items.append(cluster_item)
+                    row_items[idx] = cluster_item
+                clusters[cluster_id] = items
             
             return {
                 'clusters': clusters,
+                # 每行的时间排序键（int64），按行号对齐，选最新的若干条时直接在整列上计算
+                'sort_keys': sort_keys,
+                # 行号 -> 聚类结果条目，按行号直接取条目不必再拼接各聚类
+                'row_items': row_items,
                 'changes': self.track_prompt_changes(
                     df['prompt'].tolist(),
                     df['timestamp'].tolist()
                 )
             }
         except Exception as e:
-            print(f"分析用户prompts时出错: {str(e)}")
-            traceback.print_exc()
+            logger.exception("分析用户prompts时出错: %s", e)
             return None
 
     def check_models(self):
@@ -359,7 +447,8 @@ def generate_html_report(analysis_results, output_dir):
             reverse=True
         )
         
-        user_html = f"""
+        # 页面片段先放进列表，最后一次拼接，避免字符串反复重新分配
+        user_parts = [f"""
         <div class="user-report">
             <h2>用户 {user_id} 的Prompt分析</h2>
             
@@ -372,16 +461,16 @@ def generate_html_report(analysis_results, output_dir):
             </div>
             
             <h3 id="timeline">按时间顺序的Prompt变化</h3>
-        """
+        """]
         
         # 获取按时间排序的prompts
         all_prompts = []
         for cluster in results['clusters'].values():
             all_prompts.extend(cluster)
-        all_prompts.sort(key=lambda x: x['timestamp'])
+        all_prompts.sort(key=itemgetter('timestamp'))
         
         # 显示按时间顺序的prompts及其差异
-        user_html += '<div class="prompts-container">'
+        user_parts.append('<div class="prompts-container">')
         for i, curr_prompt in enumerate(all_prompts):
             # 计算差异（如果不是第一个prompt）
             diff_html = ''
@@ -406,7 +495,7 @@ def generate_html_report(analysis_results, output_dir):
                 diff_html += '</div>'
 
             # 使用 f-string 确保变量被正确替换
-            user_html += f"""
+            user_parts.append(f"""
             <div class="prompt">
                 <div class="prompt-content">
                     <div class="timestamp">{curr_prompt['timestamp']}</div>
@@ -417,21 +506,21 @@ def generate_html_report(analysis_results, output_dir):
                     <img class="preview-image" src="{curr_prompt['preview_url']}" alt="预览图">
                 </div>
             </div>
-            """
+            """)
         
-        user_html += "</div>"
+        user_parts.append("</div>")
         
         # 修改聚类视图部分，使用排序后的聚类
-        user_html += '<h3 id="clusters">Prompt聚类（按数量排序）</h3>'
+        user_parts.append('<h3 id="clusters">Prompt聚类（按数量排序）</h3>')
         for cluster_id, prompts in sorted_clusters:
-            user_html += f"""
+            user_parts.append(f"""
             <div class="cluster" id="cluster_{cluster_id}">
                 <h4>聚类 {cluster_id} ({len(prompts)} 条Prompt)</h4>
                 <div class="prompts-container">
-            """
+            """)
             
             for p in prompts:
-                user_html += f"""
+                user_parts.append(f"""
                 <div class="prompt">
                     <div class="prompt-content">
                         <div class="timestamp">{p['timestamp']}</div>
@@ -441,22 +530,22 @@ def generate_html_report(analysis_results, output_dir):
                         <img class="preview-image" src="{p['preview_url']}" alt="预览图">
                     </div>
                 </div>
-                """
-            user_html += "</div></div>"
+                """)
+            user_parts.append("</div></div>")
         
         # 添加返回顶部按钮
-        user_html += """
+        user_parts.append("""
             <div style="position: fixed; bottom: 20px; right: 20px;">
                 <a href="#" class="nav-button" style="background: #333; color: white;">返回顶部</a>
             </div>
-        """
+        """)
         
-        user_html += "</div>"
+        user_parts.append("</div>")
         
         # 保存用户页面
         user_file = os.path.join(output_dir, f'user_{user_id}.html')
         with open(user_file, 'w', encoding='utf-8') as f:
-            f.write(user_html)
+            f.write(''.join(user_parts))
         
         # 添加到主页面
         index_html += f'<p><a href="user_{user_id}.html">用户 {user_id} 的分析报告</a></p>'
@@ -533,27 +622,61 @@ def compute_prompt_diff(prev_prompt, curr_prompt):
     
     return diff_info
 
+def timestamp_sort_keys(timestamps):
+    """把时间列转换为 int64 排序键"""
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        return timestamps.to_numpy(dtype='datetime64[ns]').view('int64')
+    if pd.api.types.is_numeric_dtype(timestamps):
+        return timestamps.fillna(0).to_numpy(dtype='int64')
+    return pd.to_datetime(timestamps, errors='coerce').to_numpy(dtype='datetime64[ns]').view('int64')
+
+def init_jieba():
+    """加载 jieba 词典，词典缓存放到 JIEBA_CACHE_DIR；目录无法创建时使用 jieba 默认的临时目录"""
+    try:
+        os.makedirs(JIEBA_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning("无法创建 jieba 缓存目录 %s，使用默认目录: %s", JIEBA_CACHE_DIR, e)
+    else:
+        jieba.dt.tmp_dir = JIEBA_CACHE_DIR
+    jieba.initialize()
+
+@lru_cache(maxsize=8192)
+def tokenize_prompt(text):
+    """分词结果按文本缓存，同一个prompt只分词一次"""
+    return tuple(jieba.cut(text))
+
+@lru_cache(maxsize=8192)
+def token_set(text):
+    """prompt的词集合，同一个prompt在多次比较中复用"""
+    return frozenset(tokenize_prompt(text))
+
+@lru_cache(maxsize=4096)
 def analyze_word_differences(prev_prompt, curr_prompt):
-    """分析两个prompt之间的词语差异"""
+    """分析两个prompt之间的词语差异，结果按 (prev, curr) 缓存，调用方不要修改返回值"""
     # 分词
-    prev_words = set(jieba.cut(prev_prompt))
-    curr_words = set(jieba.cut(curr_prompt))
+    prev_tokens = tokenize_prompt(prev_prompt)
+    curr_tokens = tokenize_prompt(curr_prompt)
+    prev_words = token_set(prev_prompt)
+    curr_words = token_set(curr_prompt)
     
     # 找出独特的词语
     prev_unique = prev_words - curr_words  # 在前一个prompt中独有的词
     curr_unique = curr_words - prev_words  # 在当前prompt中独有的词
     
     # 构建带标记的HTML文本
-    curr_html = ''
-    for word in jieba.cut(curr_prompt):
-        if word in curr_unique:
-            curr_html += f'<span class="word-added">{word}</span>'
-        elif word in prev_unique:
-            curr_html += f'<span class="word-removed">{word}</span>'
-        else:
-            curr_html += word
+    curr_html = ''.join(
+        f'<span class="word-added">{word.translate(HTML_ESCAPE_TABLE)}</span>' if word in curr_unique
+        else word.translate(HTML_ESCAPE_TABLE)
+        for word in curr_tokens
+    )
+    prev_html = ''.join(
+        f'<span class="word-removed">{word.translate(HTML_ESCAPE_TABLE)}</span>' if word in prev_unique
+        else word.translate(HTML_ESCAPE_TABLE)
+        for word in prev_tokens
+    )
     
     return {
+        'prev_html': prev_html,
         'curr_html': curr_html,
         'prev_unique': list(prev_unique),
         'curr_unique': list(curr_unique)
@@ -0,0 +1,39 @@
+import os
+import sys
+import zlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import PromptAnalysisApp
+from keyword_analysis import PromptAnalyzer
+
+class StubModel:
+    """按词哈希到固定维度的词袋向量，结果确定，不需要下载模型"""
+    def encode(self, prompts, normalize_embeddings=False, **kwargs):
+        embeddings = np.zeros((len(prompts), 16), dtype=np.float32)
+        for row, prompt in enumerate(prompts):
+            for word in prompt.split():
+                embeddings[row, zlib.crc32(word.encode()) % 16] += 1
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+@pytest.fixture
+def stub_analyzer():
+    """不加载模型的 PromptAnalyzer，只替换 st_model"""
+    analyzer = PromptAnalyzer.__new__(PromptAnalyzer)
+    analyzer.st_model = StubModel()
+    analyzer._embedding_cache = OrderedDict()
+    analyzer._embedding_lock = threading.Lock()
+    return analyzer
+
+@pytest.fixture
+def app():
+    """不加载模型的 PromptAnalysisApp，只测试数据和渲染相关的方法"""
+    return PromptAnalysisApp.__new__(PromptAnalysisApp)
@@ -0,0 +1,110 @@
+import os
+import sys
+import random
+import numpy as np
+import pandas as pd
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAVED_COLUMN = '是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)'
+
+def test_df_setter_keeps_input(app):
+    """测试设置数据时不修改调用方的 DataFrame"""
+    df = pd.DataFrame({
+        '用户UID': [1, 2, 1],
+        'prompt': ['a', 'b', 'c'],
+        '生成时间(精确到秒)': [1700000000, 1700000060, 1700000120],
+        SAVED_COLUMN: [1, 0, 1],
+    })
+    original = df.copy()
+    app.df = df
+    pd.testing.assert_frame_equal(df, original)
+    assert '_ts' in app.df.columns and '_saved' in app.df.columns
+    assert app.get_user_data('1')['prompt'].tolist() == ['a', 'c']
+
+def test_saved_column_types(app):
+    """测试保存状态列是字符串或含空值时按未采纳处理，不会报错"""
+    for values in (['1', '0', 'yes', None], [1.0, 0.0, None, 2.0], pd.array([1, 0, None, 2], dtype='Int64')):
+        app.df = pd.DataFrame({'用户UID': ['u'] * 4, SAVED_COLUMN: values})
+        assert app.df['_saved'].tolist() == [True, False, False, False]
+
+def test_p_date_formats(app):
+    """测试 p_date 的 20240101 和 2024-01-01 写法都能解析，无法解析的为 NaT"""
+    app.df = pd.DataFrame({
+        '用户UID': ['u'] * 4,
+        'p_date': ['20240101', '2024-02-15', None, 'unknown'],
+    })
+    assert app.df['_ts'].tolist()[:2] == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-02-15')]
+    assert app.df['_ts'].isna().tolist() == [False, False, True, True]
+
+    app.df = pd.DataFrame({'用户UID': ['u'] * 2, 'p_date': [20240101, 20231231]})
+    assert app.df['_ts'].tolist() == [pd.Timestamp('2024-01-01'), pd.Timestamp('2023-12-31')]
+
+def reference_group_rows(valid_data):
+    """原来的逐行分组实现：按 (时间, prompt) 汇总图片和保存状态，只保留有图片的分组"""
+    grouped_data = {}
+    for (_, row), is_saved in zip(valid_data.iterrows(), valid_data['_saved'].to_numpy()):
+        key = (row['_ts'], row['prompt'])
+        preview_url = row.get('生成结果预览图')
+        reference_img = row.get('指令编辑垫图') if pd.notna(row.get('指令编辑垫图')) else None
+        enter_from = row.get('生成来源（埋点enter_from）') if pd.notna(row.get('生成来源（埋点enter_from）')) else None
+        if key not in grouped_data:
+            grouped_data[key] = {
+                'timestamp': row['_ts'],
+                'prompt': row['prompt'],
+                'preview_url': [preview_url] if pd.notna(preview_url) else [],
+                'reference_img': reference_img,
+                'saved_images': [bool(is_saved)] if pd.notna(preview_url) else [],
+                'enter_from': enter_from
+            }
+        elif pd.notna(preview_url):
+            grouped_data[key]['preview_url'].append(preview_url)
+            grouped_data[key]['saved_images'].append(bool(is_saved))
+    return pd.DataFrame.from_records(
+        [group for group in grouped_data.values() if group['preview_url']],
+        columns=['timestamp', 'prompt', 'preview_url', 'reference_img', 'saved_images', 'enter_from']
+    )
+
+def test_group_prompt_rows_matches_groupby(app):
+    """测试向量化分组与原来的逐行分组结果一致"""
+    for seed in range(50):
+        rng = random.Random(seed)
+        n = rng.randint(1, 40)
+        valid_data = pd.DataFrame({
+            '_ts': pd.to_datetime([rng.randint(0, 3) for _ in range(n)], unit='s'),
+            'prompt': pd.array([rng.choice('abc') for _ in range(n)], dtype='string'),
+            '生成结果预览图': pd.array([rng.choice(['u1', 'u2', None]) for _ in range(n)], dtype='string'),
+            '_saved': np.array([rng.random() < 0.5 for _ in range(n)]),
+        })
+        if seed % 2:
+            valid_data['指令编辑垫图'] = [rng.choice(['r', None]) for _ in range(n)]
+        if seed % 3:
+            valid_data['生成来源（埋点enter_from）'] = [rng.choice(['e', np.nan]) for _ in range(n)]
+
+        expected = reference_group_rows(valid_data)
+        grouped = app.group_prompt_rows(valid_data)
+        assert grouped.columns.tolist() == expected.columns.tolist()
+        for column in expected.columns:
+            assert grouped[column].tolist() == expected[column].tolist(), (seed, column)
+
+def test_select_latest_prompts(app):
+    """测试选出的是所有聚类中最新的若干条，按时间倒序"""
+    rng = np.random.default_rng(0)
+    for n in (0, 1, 5, 50, 51, 300):
+        sort_keys = rng.integers(0, 100, n).astype(np.int64)
+        assign = rng.integers(0, 4, n)
+        row_items = [{'row': row, '_ix': int(sort_keys[row])} for row in range(n)]
+        results = {
+            'clusters': {cid: [row_items[row] for row in np.flatnonzero(assign == cid)] for cid in range(4)},
+            'sort_keys': sort_keys,
+            'row_items': row_items,
+        }
+        latest = app.select_latest_prompts(results, 50)
+        expected = sorted(range(n), key=lambda row: -sort_keys[row])[:50]
+        assert [item['_ix'] for item in latest] == [int(sort_keys[row]) for row in expected]
+        assert len(latest) == min(n, 50)
+
+if __name__ == "__main__":
+    pytest.main([__file__])
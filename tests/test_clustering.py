@@ -0,0 +1,68 @@
+import os
+import sys
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def test_null_prompts(stub_analyzer):
+    """测试空的prompt不会取到其他prompt的 embedding"""
+    analyzer = stub_analyzer
+    try:
+        analyzer.encode_prompts(['red cat', np.nan, 'blue dog'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("空值应当被拒绝")
+
+    # 分析时先去掉空的prompt，其余行照常聚类
+    df = pd.DataFrame({
+        'prompt': ['red cat', None, 'red cat', 'blue dog'],
+        'timestamp': [3, 2, 1, 0],
+        'preview_url': [['https://example.com/1.jpg']] * 4,
+    })
+    results = analyzer.analyze_user_prompts(df, 'test')
+    clusters = {cid: [item['prompt'] for item in items] for cid, items in results['clusters'].items()}
+    assert clusters == {0: ['red cat', 'red cat'], 1: ['blue dog']}
+
+def reference_clusters(embeddings, similarity_threshold=0.9):
+    """原来的逐对比较实现：依次取未归类的prompt，与所有相似且未归类的prompt组成聚类"""
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    similarity_matrix = normalized.astype(np.float64) @ normalized.T.astype(np.float64)
+    clusters = {}
+    used_indices = set()
+    for i in range(len(embeddings)):
+        if i in used_indices:
+            continue
+        similar_indices = {i}
+        for j in range(len(embeddings)):
+            if j != i and j not in used_indices and similarity_matrix[i][j] >= similarity_threshold:
+                similar_indices.add(j)
+        clusters[len(clusters)] = sorted(similar_indices)
+        used_indices.update(similar_indices)
+    return clusters
+
+def test_cluster_prompts_matches_pairwise(stub_analyzer):
+    """测试贪心聚类与原来的逐对比较结果一致"""
+    words = ['red', 'blue', 'cat', 'dog', 'tea', 'cup', 'logo', 'ink']
+    for seed in range(20):
+        rng = random.Random(seed)
+        templates = [' '.join(rng.choices(words, k=rng.randint(2, 5))) for _ in range(6)]
+        # 相同模板重复出现，另有少量模板加一个词，相似度接近阈值
+        prompts = []
+        for _ in range(rng.randint(1, 40)):
+            prompt = rng.choice(templates)
+            if rng.random() < 0.3:
+                prompt += ' ' + rng.choice(words)
+            prompts.append(prompt)
+
+        clusters = stub_analyzer.cluster_prompts(prompts)
+        expected = reference_clusters(stub_analyzer.st_model.encode(prompts))
+        assert {cid: sorted(members) for cid, members in clusters.items()} == expected, seed
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import anyio
+import pandas as pd
+import gradio as gr
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from gradio_app import GradioInterface
+
+@pytest.fixture
+def gradio_ui(monkeypatch, stub_analyzer):
+    """创建界面，后台加载的模型替换为桩对象"""
+    monkeypatch.setattr(app_module, '_load_prompt_analyzer', lambda: stub_analyzer)
+    ui = GradioInterface()
+    ui.app.analyzer  # 等待后台加载完成后再恢复
+    return ui, ui.create_interface()
+
+def find_handler(interface, name):
+    """按函数名取出绑定的事件处理函数"""
+    fns = interface.fns.values() if isinstance(interface.fns, dict) else interface.fns
+    for block_fn in fns:
+        if block_fn.fn is not None and block_fn.fn.__name__ == name:
+            return block_fn.fn
+    raise LookupError(name)
+
+def collect(handler, *args):
+    """运行异步生成器形式的处理函数，返回所有输出"""
+    async def run():
+        return [view async for view in handler(*args)]
+    return anyio.run(run)
+
+def test_category_select(gradio_ui):
+    """测试点击垂类表格后能完成聚类分析并返回视图"""
+    ui, interface = gradio_ui
+    base_timestamp = 1700000000
+    ui.app.df = pd.DataFrame({
+        '用户UID': ['12345'] * 4 + ['67890'],
+        'prompt': ['coffee cup logo', 'coffee cup logo', 'tea cup painting', 'red panda', 'red panda'],
+        '生成时间(精确到秒)': [base_timestamp, base_timestamp, base_timestamp + 60, base_timestamp + 120, base_timestamp],
+        '生成结果预览图': [f'https://example.com/{i}.jpg' for i in range(5)],
+        '是否双端采纳(下载、复制、发布、后编辑、生视频、作为参考图、去画布)': [1, 0, 0, 1, 1],
+        '聚类ID': [1, 1, 1, 2, 1],
+    })
+    handler = find_handler(interface, 'handle_category_select')
+    categories = pd.DataFrame([['1', '垂类1', '3'], ['2', '垂类2', '1']], columns=['垂类ID', '垂类名称', '数据量'])
+
+    # 点击第一行的第二个单元格，垂类ID仍按该行第一列取
+    evt = gr.SelectData(None, {'index': [0, 1], 'value': '垂类1'})
+    outputs = collect(handler, evt, '12345', 1, categories)
+    html = ''.join(view for view, _ in outputs)
+    # 统计和时间轴先返回一次，整页完成后再返回一次
+    assert len(outputs) == 2
+    assert '分析失败' not in html
+    assert 'coffee cup logo' in html
+    assert 'tea cup painting' in html
+    assert 'red panda' not in html
+
+    # 翻页时用会话中保存的结果重新渲染，不再重新聚类
+    results = outputs[-1][1]
+    assert results['clusters']
+    
+    # 再次点击同一垂类时直接复用缓存的结果
+    assert collect(handler, evt, '12345', 1, categories)[-1][1] is results
+    page_handler = find_handler(interface, 'handle_page_change')
+    views = collect(page_handler, results, 2)
+    assert views and 'coffee cup logo' in views[-1]
+    assert collect(page_handler, {}, 2) == []
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import _CLUSTERS_PER_PAGE
+
+def create_results(sizes):
+    """按给定大小构造聚类结果，条目内容不影响分页"""
+    return {'clusters': {cid: [{}] * size for cid, size in enumerate(sizes)}}
+
+def test_category_rows_pages(app):
+    """测试聚类列表按大小从大到小分页，越界页码被限制在有效范围内"""
+    sizes = [(i * 7) % 13 + 1 for i in range(2 * _CLUSTERS_PER_PAGE + 5)]
+    results = create_results(sizes)
+    expected = sorted(range(len(sizes)), key=lambda cid: sizes[cid], reverse=True)
+
+    rows, page, page_count = app.category_rows(results, 1)
+    assert (page, page_count) == (1, 3)
+    assert [row[0] for row in rows] == expected[:_CLUSTERS_PER_PAGE]
+    assert rows[0] == [expected[0], f"聚类{expected[0]}", sizes[expected[0]]]
+
+    rows, page, _ = app.category_rows(results, 99)
+    assert page == 3
+    assert [row[0] for row in rows] == expected[2 * _CLUSTERS_PER_PAGE:]
+
+    # 预先排好的顺序和部分排序得到相同的分页
+    results['cluster_order'] = app.order_clusters(results['clusters'])
+    for page in (0, 1, 2, 3):
+        assert app.category_rows(results, page) == app.category_rows(create_results(sizes), page)
+
+if __name__ == "__main__":
+    pytest.main([__file__])
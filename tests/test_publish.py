@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+import tempfile
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from app import publish_cluster_html, prune_cluster_html, _STYLE_VERSION
+
+def published_path(iframe):
+    """从 iframe 标签中取出文件路径"""
+    return iframe.split('/file=', 1)[1].split('"', 1)[0]
+
+def test_publish_and_prune():
+    """测试发布的文件带页面样式，并按过期时间和数量清理"""
+    html_dir = app_module._CLUSTER_HTML_DIR
+    app_module._CLUSTER_HTML_DIR = tempfile.mkdtemp()
+    try:
+        first = published_path(publish_cluster_html('<div class="prompt-card">a</div>'))
+        with open(first, encoding='utf-8') as f:
+            document = f.read()
+        assert '--background-base' in document
+        assert f'<div class="gradio-app-{_STYLE_VERSION}"><div class="prompt-card">a</div></div>' in document
+
+        # 相同内容复用同一个文件
+        assert published_path(publish_cluster_html('<div class="prompt-card">a</div>')) == first
+
+        second = published_path(publish_cluster_html('<div class="prompt-card">b</div>'))
+        old = time.time() - 10
+        os.utime(first, (old, old))
+        # 超过数量上限时保留最近使用的文件
+        prune_cluster_html(max_files=1)
+        assert not os.path.exists(first)
+        assert os.path.exists(second)
+
+        # 过期的文件被删除
+        os.utime(second, (old, old))
+        prune_cluster_html(ttl=5)
+        assert os.listdir(app_module._CLUSTER_HTML_DIR) == []
+    finally:
+        app_module._CLUSTER_HTML_DIR = html_dir
+
+if __name__ == "__main__":
+    test_publish_and_prune()
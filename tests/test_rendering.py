@@ -0,0 +1,87 @@
+import os
+import sys
+from itertools import product
+
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (grid_template, render_diff_section, render_cluster_diff_section,
+                 _IMAGE_TMPLS, _EMPTY_SLOT_HTML, _CLUSTER_CARDS_LIMIT)
+
+UNSAFE_PROMPT = 'draw <script>alert("x")</script> & cat'
+UNSAFE_URL = 'https://example.com/a.jpg" onload="alert(1)'
+
+def test_grid_template():
+    """测试整张网格模板与逐格拼接的结果一致，不足4张时用空位补齐"""
+    for count in range(5):
+        for saved_flags in product((False, True), repeat=count):
+            urls = [f'https://example.com/{i}.jpg' for i in range(count)]
+            expected = '<div class="image-grid">' + ''.join(
+                _IMAGE_TMPLS[saved].substitute(url=url) for url, saved in zip(urls, saved_flags)
+            ) + _EMPTY_SLOT_HTML * (4 - count) + '</div>'
+            html = grid_template(saved_flags).substitute({f'u{i}': url for i, url in enumerate(urls)})
+            assert html == expected, saved_flags
+
+def test_image_grid_limits(app):
+    """测试只显示前4张图片，逗号拼接的URL也能解析"""
+    html = app.generate_image_grid({
+        'preview_url': ' https://example.com/0.jpg, ,https://example.com/1.jpg',
+        'saved_images': True,
+    })
+    assert html.count('已保存') == 2
+    assert html.count('暂无图片') == 2
+
+    html = app.generate_image_grid({
+        'preview_url': [f'https://example.com/{i}.jpg' for i in range(6)],
+        'saved_images': [False] * 6,
+    })
+    assert 'https://example.com/3.jpg' in html
+    assert 'https://example.com/4.jpg' not in html
+
+def test_card_escaping(app):
+    """测试卡片中的prompt、来源和图片地址都经过转义"""
+    prompt = {
+        'prompt': UNSAFE_PROMPT,
+        'timestamp': 1700000000,
+        'preview_url': [UNSAFE_URL],
+        'saved_images': [True],
+        'enter_from': '<b>web</b>',
+        'reference_img': UNSAFE_URL,
+    }
+    for html in (app.generate_prompt_card(prompt), app.generate_cluster_view([prompt, dict(prompt, prompt='cat')])):
+        assert '<script>' not in html
+        assert '&lt;script&gt;' in html
+        assert 'onload="alert(1)' not in html
+        assert '<b>web</b>' not in html
+
+def test_diff_escaping():
+    """测试两种差异视图都会转义prompt中的 HTML"""
+    for render in (render_diff_section, render_cluster_diff_section):
+        html = render('draw <b>cat</b> & dog', UNSAFE_PROMPT)
+        assert html
+        assert '<script>' not in html and '<b>' not in html
+        assert '&lt;' in html and '&amp;' in html
+        # 完全相同的两条prompt没有差异部分
+        assert render(UNSAFE_PROMPT, UNSAFE_PROMPT) == ''
+
+def test_cluster_view_limit(app):
+    """测试聚类详情只显示最新的若干组，流式返回的次数按几何级数增长"""
+    prompts = [{
+        'prompt': f'prompt {i}',
+        'timestamp': 1700000000 + i,
+        'preview_url': [f'https://example.com/{i}.jpg'],
+        'saved_images': [False],
+    } for i in range(120)]
+    html = app.generate_cluster_view(prompts)
+    assert html.count('class="cluster-container"') == _CLUSTER_CARDS_LIMIT
+    assert 'prompt 119' in html and 'prompt 69<' not in html
+    assert '共 120 组' in html
+
+    chunks = list(app.stream_cluster_view(prompts))
+    assert chunks[-1] == html
+    assert len(chunks) <= 6
+
+if __name__ == "__main__":
+    pytest.main([__file__])
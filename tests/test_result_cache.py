@@ -0,0 +1,29 @@
+import os
+import sys
+
+# 添加项目根目录到 Python 路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import ResultCache
+
+def test_lru_eviction():
+    """测试超过容量时淘汰最久未使用的条目"""
+    cache = ResultCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    # 访问 a 之后，b 成为最久未使用的条目
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+def test_ttl_expiry():
+    """测试条目过期后不再返回"""
+    cache = ResultCache(maxsize=4, ttl=-1)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_ttl_expiry()